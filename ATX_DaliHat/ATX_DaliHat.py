@@ -3,13 +3,33 @@ import sys
 import RPi.GPIO as GPIO
 from   enum import IntEnum
 import time
+import json
+import os
+from   collections import namedtuple
 
 #Serial Debug prints can be set to True OR False
 DBG_ENABLED = False
 
-#Time Delay Constants
-DaliTxDelay = 0.125
-DaliRxDelay = 0.200
+#DALI Frame Timing.A forward frame takes ~16ms on the bus,so commands are paced one frame time apart rather than sleeping a fixed delay
+DALI_FRAME_TIME = 0.025
+DALI_RESET_TIME = 0.300
+
+#Time allowed for a reply line from the HAT.DALI answers within ~22ms of the query frame,the HAT answers 'N' if nothing arrives
+DALI_QUERY_TIMEOUT = 0.100
+HAT_REPLY_TIMEOUT = 0.100
+DALI_QUERY_RETRIES = 5
+
+#Status queries made before a short address is taken to be empty,a single backward frame can be lost on a busy bus
+PRESENCE_QUERY_ATTEMPTS = 3
+
+#Size of the receive buffer,replies are a few characters terminated by '\n'
+RX_BUFFER_SIZE = 64
+
+#DALI 'Yes' backward frame
+DALI_YES = 0xFF
+
+#Scene level that removes a device from the scene
+DALI_MASK = 0xFF
 
 #DALI Broadcast address
 BROADCAST_ADDRESS = 0x7F
@@ -22,8 +42,64 @@ MIN_SHORT_ADDRESS = 0x00
 MAX_RANDOM_ADDRESS = 0xFFFFFF
 MIN_RANDOM_ADDRESS = 0x000000
 
+#DALI Group & Scene Ranges.Groups are addressed through the short address formula as GROUP_ADDRESS_BASE + group
+GROUP_ADDRESS_BASE = 0x40
+MAX_GROUPS = 16
+MAX_SCENES = 16
+
 #DALI Commands
-#class DALI_Commands(IntEnum):
+class DALI_Commands(IntEnum):
+    GO_TO_SCENE = 0x10
+    STORE_DTR_AS_SCENE = 0x40
+    ADD_TO_GROUP = 0x60
+    REMOVE_FROM_GROUP = 0x70
+    QUERY_STATUS = 0x90
+    QUERY_DEVICE_TYPE = 0x99
+    QUERY_ACTUAL_LEVEL = 0xA0
+    QUERY_MAX_LEVEL = 0xA1
+    QUERY_MIN_LEVEL = 0xA2
+    QUERY_GROUPS_0_7 = 0xC0
+    QUERY_GROUPS_8_15 = 0xC1
+
+#DALI Special Commands,sent in the address byte
+class DALI_SpecialCommands(IntEnum):
+    TERMINATE = 0xA1
+    DATA_TRANSFER_REGISTER = 0xA3
+    INITIALISE = 0xA5
+    RANDOMISE = 0xA7
+    COMPARE = 0xA9
+    WITHDRAW = 0xAB
+    SEARCHADDRH = 0xB1
+    SEARCHADDRM = 0xB3
+    SEARCHADDRL = 0xB5
+    PROGRAM_SHORT_ADDRESS = 0xB7
+
+#INITIALISE selectors,every device or only devices without a short address
+INITIALISE_ALL = 0x00
+INITIALISE_UNADDRESSED = 0xFF
+
+#Time each device is switched on & off while identifying it during commissioning
+IDENTIFY_BLINK_TIME = 1
+
+#Reply line from the HAT.Type is the leading character,'J' (backward frame,Value holds the byte),'N' (no backward frame),
+#'D' (bus status) or 'V' (version),Raw is the whole line without its terminator.Type is None when no reply arrived in time
+DaliReply = namedtuple('DaliReply',['Type','Value','Raw'])
+
+DALI_NO_REPLY = DaliReply(None,None,'')
+
+def ParseDaliReply(Line):
+    
+    if not Line:
+        return DaliReply('?',None,Line)
+    
+    Value = None
+    if Line[0] == 'J':
+        try:
+            Value = int(Line[1:3],base = 16)
+        except ValueError:
+            return DaliReply('?',None,Line)
+    
+    return DaliReply(Line[0],Value,Line)
 
 #enums used for configuring pins
 class ATX_DaliHatPwrPins(IntEnum):
@@ -42,7 +118,18 @@ class ATX_DaliHat():
     def __init__(self,SerialPortName):
     
         #Create Serial Port Name
-        self.ATX_DaliHatSerial = serial.Serial(SerialPortName,baudrate = 19200,parity=serial.PARITY_NONE,stopbits=serial.STOPBITS_ONE,bytesize=serial.EIGHTBITS, timeout=1,)
+        self.ATX_DaliHatSerial = serial.Serial(SerialPortName,baudrate = 19200,parity=serial.PARITY_NONE,stopbits=serial.STOPBITS_ONE,bytesize=serial.EIGHTBITS, timeout=HAT_REPLY_TIMEOUT,)
+        
+        #Preallocated receive buffer,bytes after a reply terminator are kept for the next reply
+        self.RxBuffer = bytearray(RX_BUFFER_SIZE)
+        self.RxView = memoryview(self.RxBuffer)
+        self.RxLength = 0
+        
+        #Earliest time at which the next command may go out on the bus
+        self.NextTxTime = 0
+        
+        #Search address bytes (high,middle,low) last sent during commissioning,None until sent
+        self.SearchAddress = (None,None,None)
 
         #Configure GPIOs used to check power status
         GPIO.setmode(GPIO.BCM)
@@ -51,17 +138,75 @@ class ATX_DaliHat():
         
         self.CheckPwrStatus()
     
-    def PrintDALI_HatVersionInfo(self):
+    def SetTimeout(self,Timeout):
         
-        #Query DALI Hat version status
-        self.ATX_DaliHatSerial.write("v\n".encode())
+        #Reconfiguring the port is a system call,so only do it when the timeout actually changes
+        if self.ATX_DaliHatSerial.timeout != Timeout:
+            self.ATX_DaliHatSerial.timeout = Timeout
+    
+    def Send(self,Command,Frames = 1,HoldTime = 0):
+        
+        #Wait until the previous command has had time to go out on the bus
+        Wait = self.NextTxTime - time.monotonic()
+        if Wait > 0:
+            time.sleep(Wait)
+        
+        self.ATX_DaliHatSerial.write(Command)
+        
+        #'t' commands are sent twice,some commands need additional time to take effect on the devices
+        self.NextTxTime = time.monotonic() + Frames * DALI_FRAME_TIME + HoldTime
+    
+    def SendTwice(self,Command,HoldTime = 0):
+        
+        self.Send(Command,2,HoldTime)
+    
+    def ReadReply(self,Timeout):
+        
+        Deadline = time.monotonic() + Timeout
+        self.SetTimeout(Timeout)
+        
+        while True:
+            
+            #Return the first complete line in the buffer
+            End = self.RxBuffer.find(b'\n',0,self.RxLength)
+            if End != -1:
+                Line = self.RxBuffer[:End].decode("utf-8","replace").strip()
+                self.RxBuffer[:self.RxLength - End - 1] = self.RxBuffer[End + 1:self.RxLength]
+                self.RxLength -= End + 1
+                if Line:
+                    return ParseDaliReply(Line)
+                continue
+            
+            #A line longer than the buffer is garbage,drop it
+            if self.RxLength == RX_BUFFER_SIZE:
+                self.RxLength = 0
+            
+            if time.monotonic() >= Deadline:
+                return DALI_NO_REPLY
+            
+            #Read whatever has arrived,or block for the first byte of the reply
+            Count = min(max(self.ATX_DaliHatSerial.in_waiting,1),RX_BUFFER_SIZE - self.RxLength)
+            Received = self.ATX_DaliHatSerial.readinto(self.RxView[self.RxLength:self.RxLength + Count])
+            if not Received:
+                return DALI_NO_REPLY
+            self.RxLength += Received
+    
+    def Query(self,Command,Timeout = DALI_QUERY_TIMEOUT):
+        
+        #Replies left over from earlier commands must not be taken as the answer to this one
+        Wait = self.NextTxTime - time.monotonic()
+        if Wait > 0:
+            time.sleep(Wait)
+        self.ClearInputSerialBuffer()
+        
+        self.Send(Command)
         
-        #Time to allow for transmission & response
-        time.sleep(DaliTxDelay/2)
+        return self.ReadReply(Timeout)
+    
+    def PrintDALI_HatVersionInfo(self):
         
-        #Read response
-        bytesAvailable = self.ATX_DaliHatSerial.inWaiting()
-        Response = self.ATX_DaliHatSerial.read(bytesAvailable).decode("utf-8")
+        #Query DALI Hat version status
+        Response = self.Query("v\n".encode(),HAT_REPLY_TIMEOUT).Raw
                 
         #Print DALI Hat version
         print("ATX DALI HAT: V" + Response[1:7])
@@ -72,17 +217,7 @@ class ATX_DaliHat():
     def GetDALI_BusStatus(self):
 
         #Query DALI Bus state
-        self.ATX_DaliHatSerial.write("d\n".encode())
-        
-        #Time to allow for transmission & response
-        time.sleep(DaliTxDelay)
-        
-        #Read response
-        bytesAvailable = self.ATX_DaliHatSerial.inWaiting()
-        Response = self.ATX_DaliHatSerial.read(bytesAvailable).decode("utf-8")
-        
-        #Strip newline characters from response
-        Response = Response.replace("\n","")
+        Response = self.Query("d\n".encode(),HAT_REPLY_TIMEOUT).Raw
                 
         #Print DALI Bus state
         if (Response.find("D01") != -1):
@@ -115,7 +250,7 @@ class ATX_DaliHat():
     def SetTargetLevel(self,DevAddress,TargetLevel):
         
         #Set target level
-        self.ATX_DaliHatSerial.write("h%02X%02X\n".encode()%(2*DevAddress,TargetLevel))
+        self.Send("h%02X%02X\n".encode()%(2*DevAddress,TargetLevel))
     
     def SetDeviceState(self,DevAddress,DeviceState):
     
@@ -123,70 +258,44 @@ class ATX_DaliHat():
         On_Off_State =  254 * DeviceState
     
         #Set device either on or off
-        self.ATX_DaliHatSerial.write("h%02X%02X\n".encode()%(2*DevAddress,On_Off_State))
+        self.Send("h%02X%02X\n".encode()%(2*DevAddress,On_Off_State))
         
     def ClearInputSerialBuffer(self):
         
-        #Get number of bytes in input buffer
-        bytesAvailable = self.ATX_DaliHatSerial.inWaiting()
-        self.ATX_DaliHatSerial.read(bytesAvailable)
+        #Discard unread replies,both in the driver & in the receive buffer
+        self.ATX_DaliHatSerial.reset_input_buffer()
+        self.RxLength = 0
         
     def Reset(self,DevAddress):
     
-        #Reset all variables for specified device on bus
-        self.ATX_DaliHatSerial.write("t%02X20\n".encode()%(2*DevAddress + 1))
-        
-        time.sleep(4*DaliTxDelay)
+        #Reset all variables for specified device on bus,devices need time to complete the reset before the next command
+        self.SendTwice("t%02X20\n".encode()%(2*DevAddress + 1),DALI_RESET_TIME)
     
     def QueryReset(self,DevAddress):
             
         #Send Query Reset command
-        self.ATX_DaliHatSerial.write("h%02X95\n".encode()%(2*DevAddress + 1))
-        
-        #Atleast 200ms is require for response
-        time.sleep(DaliRxDelay)
-        
-        #Determine number bytes in input buffer
-        bytesAvailable = self.ATX_DaliHatSerial.inWaiting()
-        
-        #Read Response
-        Response = self.ATX_DaliHatSerial.read(bytesAvailable).decode("utf-8")
+        Response = self.Query("h%02X95\n".encode()%(2*DevAddress + 1))
         
-        #Strip newline characters from response
-        Response = Response.replace("\n","")
+        print(Response.Raw)
         
-        print(Response)
+        #Device answers "JFF or Yes" if it is in its reset state
+        return Response.Type == 'J' and Response.Value == DALI_YES
         
-        #Search buffer for "JFF or Yes" response
-        if(Response.find("JFF") != -1):
-            return True
         
-        return False;
+    def QueryLevel(self,DevAddress,Default = 0):
         
+        #Default is returned if the device does not answer
+        TargetLevel = Default
         
-    def QueryLevel(self,DevAddress):
-        
-        for RetryCount in range(5):
-            
-            #Clear input serial buffer
-            self.ClearInputSerialBuffer()
+        for RetryCount in range(DALI_QUERY_RETRIES):
             
             #Query target Level
-            self.ATX_DaliHatSerial.write("h%02XA0\n".encode()%(2*DevAddress + 1))
-            
-            #Read Response
-            Response = self.ATX_DaliHatSerial.read(4).decode("utf-8")
-            
-            #strip newline characters from response
-            Response = Response.strip()
-        
-            TargetLevel = 0
+            Response = self.Query("h%02XA0\n".encode()%(2*DevAddress + 1))
             
-            #Confirm that response begins with a 'J' as per documentation
-            if Response[0] == 'J':
+            #Confirm that response begins with a 'J' as per documentation,the level is the backward frame
+            if Response.Type == 'J':
                 
-                #Combine 2nd & 3rd character of response to form a single string represent target level in hex format and then convert to integer
-                TargetLevel = int(Response[1] + Response[2], base = 16)
+                TargetLevel = Response.Value
                 #print("Current Target Level Of Device " + str(DevAddress)+ " is " + str(TargetLevel))
         
                 return TargetLevel
@@ -198,197 +307,261 @@ class ATX_DaliHat():
     
     def QueryStatus(self,DevAddress):
      
-        #Clear input serial buffer
-        self.ClearInputSerialBuffer()
- 
         #Query Device Status
-        self.ATX_DaliHatSerial.write("h%02X90\n".encode()%(2*DevAddress + 1))
-
-        #Transmission Delay
-        time.sleep(DaliTxDelay)
+        Response = self.Query("h%02X90\n".encode()%(2*DevAddress + 1))
 
-        #Read number of bytes available
-        bytesAvailable = self.ATX_DaliHatSerial.inWaiting()
-
-        #Read Response
-        Response = self.ATX_DaliHatSerial.read(bytesAvailable).decode("utf-8")
-        
-        #Strip newline characters from response
-        Response = Response.replace("\n","")
-
-        #Response must contain 'J' for it to be valid , refer to documentation
-        if(Response.find("J") == -1):
+        #Response must begin with 'J' for it to be valid , refer to documentation
+        if(Response.Type != 'J'):
             print("Invalid Response Received")
-        else:
-            print("Status of Device [%02X] is [%s]"%(DevAddress,Response))
+            return None
+        
+        print("Status of Device [%02X] is [%s]"%(DevAddress,Response.Raw))
+        
+        #Status byte,None if the device did not answer
+        return Response.Value
+    
+    def QueryValue(self,DevAddress,Command):
+        
+        #Single attempt at a query answered with a value,None if the device does not answer
+        Response = self.Query("h%02X%02X\n".encode()%(2*DevAddress + 1,Command))
+        
+        return Response.Value if Response.Type == 'J' else None
+    
+    def QueryPresence(self,DevAddress,Attempts = PRESENCE_QUERY_ATTEMPTS):
+        
+        #Status of the device at a short address,None if no device answers any of Attempts status queries
+        for Attempt in range(Attempts):
+            
+            Status = self.QueryValue(DevAddress,DALI_Commands.QUERY_STATUS)
+            if Status is not None:
+                return Status
+        
+        return None
                 
-    def Initialize(self):
+    def Initialize(self,Selector = INITIALISE_ALL):
+        
+        #Broadcast Initialize command,INITIALISE_UNADDRESSED limits commissioning to devices without a short address
+        self.SendTwice("t%02X%02X\n".encode()%(DALI_SpecialCommands.INITIALISE,Selector))
         
-        #Broadcast Initialize command
-        self.ATX_DaliHatSerial.write("tA500\n".encode())
+        #Search address registers of the devices are unknown from here on
+        self.SearchAddress = (None,None,None)
         
     def Randomize(self):
       
         #Broadcast randomize command
-        self.ATX_DaliHatSerial.write("tA700\n".encode())
+        self.SendTwice("tA700\n".encode())
+        
+    def GroupAddress(self,Group):
+        
+        #Address to pass to SetTargetLevel,SetDeviceState etc. to reach every member of a group in a single frame
+        if not 0 <= Group < MAX_GROUPS:
+            raise ValueError("DALI group must be 0-15")
+        
+        return GROUP_ADDRESS_BASE + Group
+    
+    def SetGroupLevel(self,Group,TargetLevel):
+        
+        self.SetTargetLevel(self.GroupAddress(Group),TargetLevel)
+    
+    def AddToGroup(self,DevAddress,Group):
         
+        #Raises ValueError for an invalid group
+        self.GroupAddress(Group)
+        
+        #Configuration commands must be sent twice
+        self.SendTwice("t%02X%02X\n".encode()%(2*DevAddress + 1,DALI_Commands.ADD_TO_GROUP + Group))
+    
+    def RemoveFromGroup(self,DevAddress,Group):
+        
+        #Raises ValueError for an invalid group
+        self.GroupAddress(Group)
+        
+        self.SendTwice("t%02X%02X\n".encode()%(2*DevAddress + 1,DALI_Commands.REMOVE_FROM_GROUP + Group))
+    
+    def QueryGroups(self,DevAddress):
+        
+        #Groups a device belongs to,None if it does not answer.Membership is reported as two bitmasks,groups 0-7 & 8-15
+        Groups = []
+        
+        for Command,FirstGroup in ((DALI_Commands.QUERY_GROUPS_0_7,0),(DALI_Commands.QUERY_GROUPS_8_15,8)):
+            
+            Response = self.Query("h%02X%02X\n".encode()%(2*DevAddress + 1,Command))
+            if Response.Type != 'J':
+                return None
+            
+            Groups.extend(FirstGroup + Bit for Bit in range(8) if Response.Value & (1 << Bit))
+        
+        return Groups
+    
+    def StoreScene(self,DevAddress,Scene,TargetLevel):
+        
+        if not 0 <= Scene < MAX_SCENES:
+            raise ValueError("DALI scene must be 0-15")
+        
+        #Load the level into the DTR,then store it as the scene level of the addressed device(s)
+        self.Send("h%02X%02X\n".encode()%(DALI_SpecialCommands.DATA_TRANSFER_REGISTER,TargetLevel))
+        self.SendTwice("t%02X%02X\n".encode()%(2*DevAddress + 1,DALI_Commands.STORE_DTR_AS_SCENE + Scene))
+    
+    def RecallScene(self,DevAddress,Scene):
+        
+        #Every addressed device goes to its stored level for the scene,devices without one ignore it
+        if not 0 <= Scene < MAX_SCENES:
+            raise ValueError("DALI scene must be 0-15")
+        
+        self.Send("h%02X%02X\n".encode()%(2*DevAddress + 1,DALI_Commands.GO_TO_SCENE + Scene))
+    
     def AssignSingleAddress(self,DeviceAddress):
                 
         #Load the DTR into a single device
-        self.ATX_DaliHatSerial.write('hA3%02X\n'.encode()%(2*DeviceAddress + 1))
-        
-        #Allow delay for DTR write to be written
-        time.sleep(DaliTxDelay)
+        self.Send('hA3%02X\n'.encode()%(2*DeviceAddress + 1))
         
         #Save DTR as short address
-        self.ATX_DaliHatSerial.write('tFF80\n'.encode())
+        self.SendTwice('tFF80\n'.encode())
+        
+    def SetSearchAddress(self,LongAddress):
         
-        #Allow time for DTR to be written to short address
-        time.sleep(DaliTxDelay)
+        #Only the search address bytes that differ from the last ones sent go out on the bus
+        Bytes = ((LongAddress >> 16) & 0xFF,(LongAddress >> 8) & 0xFF,LongAddress & 0xFF)
+        Commands = (DALI_SpecialCommands.SEARCHADDRH,DALI_SpecialCommands.SEARCHADDRM,DALI_SpecialCommands.SEARCHADDRL)
         
-    def CommissionDevices(self):
+        for Command,Byte,SentByte in zip(Commands,Bytes,self.SearchAddress):
+            if Byte != SentByte:
+                self.Send("h%02X%02X\n".encode()%(Command,Byte))
         
-        #Variable to track search boundaries during binary search
-        Low_LongAdd  = MIN_RANDOM_ADDRESS
+        self.SearchAddress = Bytes
+    
+    def CompareSearchAddress(self,LongAddress):
+        
+        #True if any device taking part has a long address at or below LongAddress.Several devices answering at once collide,
+        #so anything other than 'N' or silence counts as a yes
+        self.SetSearchAddress(LongAddress)
+        
+        Response = self.Query("h%02X00\n".encode()%DALI_SpecialCommands.COMPARE)
+        
+        return Response.Type not in (None,'N')
+    
+    def FindLowestLongAddress(self):
+        
+        #Binary search for the lowest long address still taking part,None once every device has been withdrawn
+        if not self.CompareSearchAddress(MAX_RANDOM_ADDRESS):
+            return None
+        
+        Low_LongAdd = MIN_RANDOM_ADDRESS
         High_LongAdd = MAX_RANDOM_ADDRESS
         
-        #Variable to track 'guess' address during binary search
-        Random_24_BitAdd = (int)((Low_LongAdd + High_LongAdd)/2)
+        while Low_LongAdd < High_LongAdd:
+            
+            Random_24_BitAdd = (Low_LongAdd + High_LongAdd) // 2
+            
+            if self.CompareSearchAddress(Random_24_BitAdd):
+                High_LongAdd = Random_24_BitAdd
+            else:
+                Low_LongAdd = Random_24_BitAdd + 1
+        
+        return Low_LongAdd
+    
+    def IdentifyDevice(self,ShortAddress):
+        
+        #Switch device off,on & off again so it can be found on site
+        self.SetTargetLevel(ShortAddress,0)
+        time.sleep(IDENTIFY_BLINK_TIME)
+        self.SetTargetLevel(ShortAddress,254)
+        time.sleep(IDENTIFY_BLINK_TIME)
+        self.SetTargetLevel(ShortAddress,0)
+    
+    def LoadAddressMap(self,MapFile):
         
-        #Variables to split 24-bit address into high,middle & low bytes
-        HighByte = 0x00
-        MiddleByte = 0x00
-        LowByte = 0x00
+        #Long to short address map saved by an earlier commissioning run,empty if there is none
+        if MapFile is None or not os.path.exists(MapFile):
+            return {}
         
-        #Assigned short addresses as devices are enumerated
-        ShortAddress = MIN_SHORT_ADDRESS
-                
-        #Switch all devices off
-        self.SetTargetLevel(BROADCAST_ADDRESS,0)
+        with open(MapFile) as File:
+            return {int(LongAddress,16) : ShortAddress for LongAddress,ShortAddress in json.load(File)['LongToShort'].items()}
+    
+    def SaveAddressMap(self,MapFile,AddressMap):
         
-        #Allow devices to switch off before issuing reset command
-        time.sleep(DaliTxDelay)
+        #Written to a temporary file first so an interrupted save never leaves a corrupt map behind
+        TempFile = MapFile + '.tmp'
         
-        #Broadcast Reset command
-        self.Reset(BROADCAST_ADDRESS)
+        with open(TempFile,'w') as File:
+            json.dump({'LongToShort' : {'%06X'%LongAddress : ShortAddress for LongAddress,ShortAddress in sorted(AddressMap.items())}},File,indent = 2)
         
-        #Broadcast initialize command
-        self.Initialize()
+        os.replace(TempFile,MapFile)
+    
+    def CommissionDevices(self,MapFile = None,Identify = False):
         
-        #Allow time for initialization to occur
-        time.sleep(DaliTxDelay)
+        #Assign short addresses to every device on the bus & return the long to short address map.With a MapFile the map is saved
+        #after every assignment & a later run resumes from it: only devices without a short address take part,so the devices that
+        #were already addressed are left alone.Delete the file to recommission the whole bus.Identify blinks each device once addressed
+        AddressMap = self.LoadAddressMap(MapFile)
+        Resuming = bool(AddressMap)
+        
+        if Resuming:
+            
+            print("Resuming commissioning,%d devices already addressed"%len(AddressMap))
+            
+            #Only devices without a short address take part in the search & are randomized
+            self.Initialize(INITIALISE_UNADDRESSED)
+            
+        else:
+            
+            #Switch all devices off
+            self.SetTargetLevel(BROADCAST_ADDRESS,0)
+            
+            #Broadcast Reset command
+            self.Reset(BROADCAST_ADDRESS)
+            
+            #Broadcast initialize command
+            self.Initialize()
         
         #Send Randomize command
         self.Randomize()
         
-        #Allow time for start of 15 minute timer
-        time.sleep(DaliTxDelay)
+        UsedShortAddresses = set(AddressMap.values())
         
         print("Dali Master Now Searching For Long Addresses")
         
-        while ((Random_24_BitAdd <= (MAX_RANDOM_ADDRESS - 2)) and (ShortAddress <= MAX_SHORT_ADDRESS)):
-            while((High_LongAdd - Low_LongAdd) > 1):
-                   
-                #Split 24-bit address into high,middle & low bytes
-                HighByte = (Random_24_BitAdd >> 16)
-                MiddleByte = (Random_24_BitAdd >> 8) & 0x0000FF
-                LowByte = (Random_24_BitAdd & 0x0000FF)
-                                             
-                #Write Search high byte
-                self.ATX_DaliHatSerial.write("hB1%02X\n".encode()%HighByte)
-                time.sleep(DaliTxDelay)
-                
-                #Write Search middle byte
-                self.ATX_DaliHatSerial.write("hB3%02X\n".encode()%MiddleByte)
-                time.sleep(DaliTxDelay)
-                
-                #Write Search low byte
-                self.ATX_DaliHatSerial.write("hB5%02X\n".encode()%LowByte)
-                time.sleep(DaliTxDelay)
-                
-                #Transmit compare command
-                self.ATX_DaliHatSerial.write("hA900\n".encode())
-                time.sleep(DaliTxDelay)
-                                
-                bytesAvailable = self.ATX_DaliHatSerial.inWaiting()
-                                
-                #Read response of compare query
-                Response  = self.ATX_DaliHatSerial.read(bytesAvailable).decode("utf-8")
-                time.sleep(DaliTxDelay)
-                
-                #Strip newline characters from response
-                Response = Response.replace("\n","")
-                
-                #If adjust bounds based on response
-                if(Response.find("JFF") != -1):
-                    High_LongAdd = Random_24_BitAdd
-                else:
-                    Low_LongAdd = Random_24_BitAdd
-                
-                #Update midpoint
-                Random_24_BitAdd = (int)((Low_LongAdd + High_LongAdd)/2)
-                
-                print("Curent Random/Long Address : ",hex(Random_24_BitAdd + 1))
+        while True:
             
-            if(High_LongAdd != MAX_RANDOM_ADDRESS):
-                    
-                #Split new 24-bit address
-                HighByte = ((Random_24_BitAdd + 1) >> 16)
-                MiddleByte = ((Random_24_BitAdd + 1) >> 8) & 0x0000FF
-                LowByte = ((Random_24_BitAdd + 1) & 0x0000FF)
-              
-                print("Assigning short address.....")
-              
-                #Write Search high byte
-                self.ATX_DaliHatSerial.write("hB1%02X\n".encode()%HighByte)
-                time.sleep(DaliTxDelay)
-                
-                #Write Search middle byte
-                self.ATX_DaliHatSerial.write("hB3%02X\n".encode()%MiddleByte)
-                time.sleep(DaliTxDelay)
-                
-                #Write Search low byte
-                self.ATX_DaliHatSerial.write("hB5%02X\n".encode()%LowByte)
-                time.sleep(DaliTxDelay)
-                
-                #Program short address
-                self.ATX_DaliHatSerial.write("hB7%02X\n".encode()%(1 + (ShortAddress << 1)))
-                time.sleep(DaliTxDelay)
-                
-                #Send terminate command
-                self.ATX_DaliHatSerial.write("hAB00\n".encode())
-                time.sleep(DaliTxDelay)
-                
-                #Print short-address assigned
-                print("Short-Assigned : [%02X]"%ShortAddress)
-                
-                #Switch newly assigned device on and off
-                self.SetTargetLevel(ShortAddress,0)
-                
-                #Leave off for 1 second
-                time.sleep(1)
-                
-                #Switch newly assigned device on
-                self.SetTargetLevel(ShortAddress,254)
-                
-                #Leave on for 1 second
-                time.sleep(1)
-                
-                #Switch off again
-                self.SetTargetLevel(ShortAddress,0)
-                
-                #Increment short address
-                ShortAddress = ShortAddress + 1
-                
-                #Reset high part of long address in preparation for next iteration
-                High_LongAdd = MAX_RANDOM_ADDRESS
+            #Lowest short address not yet in use
+            ShortAddress = next((Address for Address in range(MIN_SHORT_ADDRESS,MAX_SHORT_ADDRESS) if Address not in UsedShortAddresses),None)
+            if ShortAddress is None:
+                print("All short addresses are in use")
+                break
+            
+            #An earlier run may have stopped between programming an address & saving the map.The device holding it no longer takes
+            #part in the search,so on resume every address is checked on the bus before it is handed out
+            if Resuming and self.QueryPresence(ShortAddress) is not None:
+                print("Short address [%02X] is already held by a device missing from the map,skipping it"%ShortAddress)
+                UsedShortAddresses.add(ShortAddress)
+                continue
+            
+            LongAddress = self.FindLowestLongAddress()
+            if LongAddress is None:
+                break
+            
+            print("Assigning short address.....")
+            
+            #Program short address into the device at the search address & withdraw it from the search
+            self.SetSearchAddress(LongAddress)
+            self.Send("h%02X%02X\n".encode()%(DALI_SpecialCommands.PROGRAM_SHORT_ADDRESS,1 + (ShortAddress << 1)))
+            self.Send("h%02X00\n".encode()%DALI_SpecialCommands.WITHDRAW)
+            
+            AddressMap[LongAddress] = ShortAddress
+            UsedShortAddresses.add(ShortAddress)
+            
+            if MapFile is not None:
+                self.SaveAddressMap(MapFile,AddressMap)
+            
+            #Print short-address assigned
+            print("Short-Assigned : [%02X] Long Address : [%06X]"%(ShortAddress,LongAddress))
+            
+            if Identify:
+                self.IdentifyDevice(ShortAddress)
         
-                #Variable to track 'guess' address during binary search
-                Random_24_BitAdd = (int)((Low_LongAdd + High_LongAdd)/2)
-                
-        else:
-            print("Commissioning Process Has Completed.Terminating Process...")
+        print("Commissioning Process Has Completed.Terminating Process...")
         
         #Send command to terminate commissioning process
-        self.ATX_DaliHatSerial.write("hA100\n".encode())
-        
\ No newline at end of file
+        self.Send("h%02X00\n".encode()%DALI_SpecialCommands.TERMINATE)
+        
+        return AddressMap
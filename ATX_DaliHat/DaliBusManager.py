@@ -0,0 +1,72 @@
+import itertools
+import queue
+import threading
+from   concurrent.futures import Future
+
+#Transaction priorities,lower values are served first.User requests go ahead of background polling
+RPC_PRIORITY = 0
+POLL_PRIORITY = 10
+
+#Single owner of the DALI bus.Every transaction on the HAT is run by one worker thread in priority order,so replies from
+#different callers can never interleave & a caller clearing the input buffer cannot throw away another caller's reply
+class DaliBusManager():
+    
+    def __init__(self,DaliHat):
+        
+        self.DaliHat = DaliHat
+        
+        #(priority,sequence,function,arguments,future),the sequence keeps equal priorities in submission order
+        self.Transactions = queue.PriorityQueue()
+        self.Sequence = itertools.count()
+        
+        self.Worker = None
+        self.Running = False
+    
+    def Start(self):
+        
+        self.Running = True
+        self.Worker = threading.Thread(target=self.Run,name="DaliBusManager",daemon=True)
+        self.Worker.start()
+    
+    def Stop(self):
+        
+        #Nothing to stop if the worker was never started
+        if self.Worker is None:
+            return
+        
+        #Queued behind everything already submitted at the lowest priority,so pending transactions complete first
+        self.Running = False
+        self.Transactions.put((float('inf'),next(self.Sequence),None,(),None))
+        self.Worker.join()
+        self.Worker = None
+    
+    def Submit(self,Priority,Function,*Args):
+        
+        #Queue Function(*Args) to run on the bus & return a concurrent.futures.Future for its result.
+        #Function may be a bound ATX_DaliHat method or any callable making several HAT calls as one transaction
+        Transaction = Future()
+        self.Transactions.put((Priority,next(self.Sequence),Function,Args,Transaction))
+        
+        return Transaction
+    
+    def Run(self):
+        
+        while True:
+            
+            Priority,Sequence,Function,Args,Transaction = self.Transactions.get()
+            
+            if Function is None:
+                if not self.Running:
+                    return
+                continue
+            
+            #Cancelled before it reached the bus
+            if not Transaction.set_running_or_notify_cancel():
+                continue
+            
+            try:
+                Result = Function(*Args)
+            except BaseException as Error:
+                Transaction.set_exception(Error)
+            else:
+                Transaction.set_result(Result)
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+from   collections import namedtuple
+from   .ATX_DaliHat import DALI_Commands, MIN_SHORT_ADDRESS, MAX_SHORT_ADDRESS, PRESENCE_QUERY_ATTEMPTS
+
+#What a bus scan found at a short address.Scanned is the unix time of the scan
+DaliDeviceInfo = namedtuple('DaliDeviceInfo',['Address','Status','DeviceType','MinLevel','MaxLevel','Level','Groups','Scanned'])
+
+#Fields that describe what a device is & how it is configured.Status & Level follow the lamp as it is dimmed & switched,
+#so a change to them alone is not worth rewriting the table
+DEVICE_IDENTITY_FIELDS = ('Address','DeviceType','MinLevel','MaxLevel','Groups')
+
+def DeviceIdentity(Device):
+    
+    return tuple(getattr(Device,Field) for Field in DEVICE_IDENTITY_FIELDS)
+
+#Inventory of the devices on the DALI bus,kept in memory & optionally in a JSON file so the application can look devices up without
+#polling the bus.Scan methods touch the bus & must run on the DALI bus owner,lookups are safe from any thread
+class DaliDeviceTable():
+    
+    def __init__(self,DaliHat,TableFile = None):
+        
+        self.DaliHat = DaliHat
+        self.TableFile = TableFile
+        
+        #Populated addresses,& the time every address was last scanned whether or not a device answered
+        self.Devices = {}
+        self.LastScanned = {}
+        
+        #Set when a device is found,lost or changes,so rescans that find nothing new do not rewrite the file
+        self.Changed = False
+        
+        self.Lock = threading.Lock()
+        
+        self.Load()
+    
+    def Load(self):
+        
+        if self.TableFile is None or not os.path.exists(self.TableFile):
+            return
+        
+        with open(self.TableFile) as File:
+            Table = json.load(File)
+        
+        with self.Lock:
+            self.Devices = {Device['Address'] : DaliDeviceInfo(**Device) for Device in Table['Devices']}
+            self.LastScanned = {int(Address) : Scanned for Address,Scanned in Table['LastScanned'].items()}
+    
+    def Save(self):
+        
+        if self.TableFile is None:
+            return
+        
+        with self.Lock:
+            Table = {'Devices' : [Device._asdict() for Address,Device in sorted(self.Devices.items())],
+                     'LastScanned' : {str(Address) : Scanned for Address,Scanned in sorted(self.LastScanned.items())}}
+            self.Changed = False
+        
+        #Written to a temporary file first so an interrupted save never leaves a corrupt table behind
+        TempFile = self.TableFile + '.tmp'
+        with open(TempFile,'w') as File:
+            json.dump(Table,File,indent = 2)
+        os.replace(TempFile,self.TableFile)
+    
+    def ScanDevice(self,ShortAddress):
+        
+        #Query everything about one address.The status query doubles as the presence check,so an empty address costs one query.
+        #A device already in the table is only dropped once it misses several status queries in a row
+        with self.Lock:
+            Known = ShortAddress in self.Devices
+        
+        Status = self.DaliHat.QueryPresence(ShortAddress,PRESENCE_QUERY_ATTEMPTS if Known else 1)
+        
+        Device = None
+        if Status is not None:
+            Device = DaliDeviceInfo(
+                Address = ShortAddress,
+                Status = Status,
+                DeviceType = self.DaliHat.QueryValue(ShortAddress,DALI_Commands.QUERY_DEVICE_TYPE),
+                MinLevel = self.DaliHat.QueryValue(ShortAddress,DALI_Commands.QUERY_MIN_LEVEL),
+                MaxLevel = self.DaliHat.QueryValue(ShortAddress,DALI_Commands.QUERY_MAX_LEVEL),
+                Level = self.DaliHat.QueryValue(ShortAddress,DALI_Commands.QUERY_ACTUAL_LEVEL),
+                Groups = self.DaliHat.QueryGroups(ShortAddress),
+                Scanned = time.time())
+        
+        with self.Lock:
+            self.LastScanned[ShortAddress] = time.time()
+            
+            Previous = self.Devices.get(ShortAddress)
+            if Device is None:
+                self.Devices.pop(ShortAddress,None)
+            else:
+                self.Devices[ShortAddress] = Device
+            
+            #Only a device appearing,disappearing or being reconfigured counts as a change
+            if (Previous is None) != (Device is None) or (Device is not None and DeviceIdentity(Device) != DeviceIdentity(Previous)):
+                self.Changed = True
+        
+        return Device
+    
+    def Scan(self,Addresses = range(MIN_SHORT_ADDRESS,MAX_SHORT_ADDRESS)):
+        
+        #Full scan of the given addresses,returns the devices found
+        Found = [Device for Device in (self.ScanDevice(Address) for Address in Addresses) if Device is not None]
+        
+        self.Save()
+        
+        return Found
+    
+    def Rescan(self,MaxAge,MaxAddresses = None):
+        
+        #Incremental rescan of up to MaxAddresses addresses not scanned within MaxAge seconds,least recently scanned first.
+        #Returns the addresses that were scanned
+        Now = time.time()
+        
+        with self.Lock:
+            Due = sorted((self.LastScanned.get(Address,0),Address) for Address in range(MIN_SHORT_ADDRESS,MAX_SHORT_ADDRESS)
+                         if Now - self.LastScanned.get(Address,0) >= MaxAge)
+        
+        Addresses = [Address for Scanned,Address in Due[:MaxAddresses]]
+        
+        for Address in Addresses:
+            self.ScanDevice(Address)
+        
+        #Scan times alone are not worth a write to the SD card,after a restart unchanged addresses are just rescanned a little early
+        if self.Changed:
+            self.Save()
+        
+        return Addresses
+    
+    def Get(self,ShortAddress):
+        
+        #Table entry for an address,None if no device was found there
+        with self.Lock:
+            return self.Devices.get(ShortAddress)
+    
+    def GetDevices(self):
+        
+        #Every device found,in address order
+        with self.Lock:
+            return [Device for Address,Device in sorted(self.Devices.items())]
+    
+    def IsScanned(self):
+        
+        #True once every address has been scanned at least once
+        with self.Lock:
+            return len(self.LastScanned) == MAX_SHORT_ADDRESS - MIN_SHORT_ADDRESS
@@ -0,0 +1,221 @@
+import math
+import threading
+import time
+from   .ATX_DaliHat import BROADCAST_ADDRESS, GROUP_ADDRESS_BASE, MAX_GROUPS, DALI_MASK
+
+#Longest time a cached level is trusted for reads,in seconds
+SHADOW_MAX_AGE = 120
+
+#Each tracked device is re-read from the bus at most this often during background reconciliation
+RECONCILE_INTERVAL = 30
+
+#Time of an update or read back that has never happened,older than any reading of the monotonic clock
+NEVER = -math.inf
+
+#Cached state of one DALI device
+class DaliShadowEntry():
+    
+    def __init__(self):
+        
+        self.Level = None
+        
+        #When the level last changed in the cache (optimistic or read back) & when it was last read back from the device.
+        #Both are NEVER until it happens,the monotonic clock can start near zero so 0 would look recent shortly after boot
+        self.Updated = NEVER
+        self.Confirmed = NEVER
+
+#Device shadow for ATX_DaliHat.Commands update the cached level optimistically & reads are answered from the cache while it is
+#fresher than MaxAge,so dashboard queries never wait on the bus.Reconcile() reads back the stalest devices in the background.
+#Bus methods (Set*,GetLevel,Reconcile) must run on the DALI bus owner,cache reads (GetCachedLevel) are safe from any thread
+class DaliShadow():
+    
+    def __init__(self,DaliHat,MaxAge = SHADOW_MAX_AGE,ReconcileInterval = RECONCILE_INTERVAL):
+        
+        self.DaliHat = DaliHat
+        self.MaxAge = MaxAge
+        self.ReconcileInterval = ReconcileInterval
+        
+        self.Devices = {}
+        
+        #Known group members (group -> set of short addresses),the devices whose full membership has been read or loaded,
+        #& stored scene levels ((short address,scene) -> level)
+        self.Groups = {}
+        self.GroupsKnown = set()
+        self.Scenes = {}
+        
+        self.Lock = threading.Lock()
+    
+    def Track(self,DevAddress):
+        
+        #Start keeping a shadow of a device,it is read back on the next reconciliation
+        with self.Lock:
+            return self.Devices.setdefault(DevAddress,DaliShadowEntry())
+    
+    def Resolve(self,DevAddress):
+        
+        #Short addresses reached by a command,a broadcast reaches every device & a group its known members.Call with the lock held
+        if DevAddress == BROADCAST_ADDRESS:
+            return list(self.Devices)
+        
+        if GROUP_ADDRESS_BASE <= DevAddress < GROUP_ADDRESS_BASE + MAX_GROUPS:
+            return list(self.Groups.get(DevAddress - GROUP_ADDRESS_BASE,()))
+        
+        return [DevAddress]
+    
+    def Invalidate(self,DevAddress):
+        
+        #A group command may reach tracked devices whose membership is unknown,their cached levels can no longer be trusted
+        #& are left for the next read back.Call with the lock held
+        if GROUP_ADDRESS_BASE <= DevAddress < GROUP_ADDRESS_BASE + MAX_GROUPS:
+            for Address,Entry in self.Devices.items():
+                if Address not in self.GroupsKnown:
+                    Entry.Updated = NEVER
+                    Entry.Confirmed = NEVER
+    
+    def Update(self,DevAddress,Level,Confirmed):
+        
+        Now = time.monotonic()
+        
+        with self.Lock:
+            
+            self.Invalidate(DevAddress)
+            for Address in self.Resolve(DevAddress):
+                Entry = self.Devices.setdefault(Address,DaliShadowEntry())
+                Entry.Level = Level
+                Entry.Updated = Now
+                if Confirmed:
+                    Entry.Confirmed = Now
+    
+    def SetTargetLevel(self,DevAddress,TargetLevel):
+        
+        self.Update(DevAddress,TargetLevel,False)
+        self.DaliHat.SetTargetLevel(DevAddress,TargetLevel)
+    
+    def SetDeviceState(self,DevAddress,DeviceState):
+        
+        self.Update(DevAddress,254 * DeviceState,False)
+        self.DaliHat.SetDeviceState(DevAddress,DeviceState)
+    
+    def SetGroupLevel(self,Group,TargetLevel):
+        
+        self.Update(self.DaliHat.GroupAddress(Group),TargetLevel,False)
+        self.DaliHat.SetGroupLevel(Group,TargetLevel)
+    
+    def AddToGroup(self,DevAddress,Group):
+        
+        self.DaliHat.AddToGroup(DevAddress,Group)
+        
+        with self.Lock:
+            for Address in self.Resolve(DevAddress):
+                self.Groups.setdefault(Group,set()).add(Address)
+    
+    def RemoveFromGroup(self,DevAddress,Group):
+        
+        self.DaliHat.RemoveFromGroup(DevAddress,Group)
+        
+        with self.Lock:
+            for Address in self.Resolve(DevAddress):
+                self.Groups.get(Group,set()).discard(Address)
+    
+    def LoadGroups(self,DevAddress,Groups):
+        
+        #Set a device's full group membership,e.g. from a DaliDeviceTable entry.Never touches the bus
+        with self.Lock:
+            for Group in range(MAX_GROUPS):
+                if Group in Groups:
+                    self.Groups.setdefault(Group,set()).add(DevAddress)
+                else:
+                    self.Groups.get(Group,set()).discard(DevAddress)
+            self.GroupsKnown.add(DevAddress)
+    
+    def RefreshGroups(self,DevAddress):
+        
+        #Read a device's group membership back from the bus,None if it does not answer
+        Groups = self.DaliHat.QueryGroups(DevAddress)
+        
+        if Groups is not None:
+            self.LoadGroups(DevAddress,Groups)
+        
+        return Groups
+    
+    def StoreScene(self,DevAddress,Scene,TargetLevel):
+        
+        self.DaliHat.StoreScene(DevAddress,Scene,TargetLevel)
+        
+        with self.Lock:
+            for Address in self.Resolve(DevAddress):
+                self.Scenes[(Address,Scene)] = TargetLevel
+    
+    def RecallScene(self,DevAddress,Scene):
+        
+        Now = time.monotonic()
+        
+        with self.Lock:
+            self.Invalidate(DevAddress)
+            for Address in self.Resolve(DevAddress):
+                Entry = self.Devices.setdefault(Address,DaliShadowEntry())
+                
+                #Devices that are not part of the scene keep their level,those whose scene level is unknown are left for the next read back
+                if self.Scenes.get((Address,Scene)) == DALI_MASK:
+                    continue
+                if (Address,Scene) in self.Scenes:
+                    Entry.Level = self.Scenes[(Address,Scene)]
+                    Entry.Updated = Now
+                else:
+                    Entry.Updated = NEVER
+                    Entry.Confirmed = NEVER
+        
+        self.DaliHat.RecallScene(DevAddress,Scene)
+    
+    def GetCachedLevel(self,DevAddress,MaxAge = None):
+        
+        #Cached level if it is fresher than MaxAge (the shadow's bound if None),else None.Never touches the bus
+        MaxAge = self.MaxAge if MaxAge is None else MaxAge
+        
+        with self.Lock:
+            Entry = self.Devices.get(DevAddress)
+            if Entry is None or Entry.Level is None or time.monotonic() - Entry.Updated > MaxAge:
+                return None
+            return Entry.Level
+    
+    def RefreshLevel(self,DevAddress):
+        
+        #Read the level back from the device,the cache is left alone if the device does not answer
+        Level = self.DaliHat.QueryLevel(DevAddress,None)
+        
+        if Level is not None:
+            self.Update(DevAddress,Level,True)
+        
+        return Level
+    
+    def GetLevel(self,DevAddress,MaxAge = None):
+        
+        #Cached level,falling back to the bus when the cache is stale
+        Level = self.GetCachedLevel(DevAddress,MaxAge)
+        
+        if Level is None:
+            self.Track(DevAddress)
+            Level = self.RefreshLevel(DevAddress)
+        
+        return Level
+    
+    def Reconcile(self,MaxDevices = 1):
+        
+        #Read back up to MaxDevices devices that have not been confirmed within ReconcileInterval,stalest first.
+        #Returns the addresses that were read
+        Now = time.monotonic()
+        
+        with self.Lock:
+            Due = sorted((Entry.Confirmed,Address) for Address,Entry in self.Devices.items() if Now - Entry.Confirmed >= self.ReconcileInterval)
+        
+        Refreshed = []
+        for Confirmed,Address in Due[:MaxDevices]:
+            
+            #Mark the attempt so an unresponsive device does not hold up the rest
+            with self.Lock:
+                self.Devices[Address].Confirmed = Now
+            
+            self.RefreshLevel(Address)
+            Refreshed.append(Address)
+        
+        return Refreshed
@@ -1 +1,4 @@
-from .ATX_DaliHat import ATX_DaliHat
\ No newline at end of file
+from .ATX_DaliHat import ATX_DaliHat, BROADCAST_ADDRESS, MIN_SHORT_ADDRESS, MAX_SHORT_ADDRESS
+from .DaliBusManager import DaliBusManager, RPC_PRIORITY, POLL_PRIORITY
+from .DaliShadow import DaliShadow
+from .DaliDeviceTable import DaliDeviceTable, DaliDeviceInfo
@@ -2,10 +2,12 @@
 import paho.mqtt.client as mqtt
 import RPi.GPIO as GPIO
 import json
+import math
 import time
 import pyRTOS
-from   LovatoD111 import LovatoD111
-from   ATX_DaliHat import ATX_DaliHat
+from   LovatoD111 import D111_Bus, D111_Registers, D111_History, D111_Proxy
+from   ATX_DaliHat import ATX_DaliHat, BROADCAST_ADDRESS, MIN_SHORT_ADDRESS, MAX_SHORT_ADDRESS, DaliBusManager, DaliShadow, DaliDeviceTable, RPC_PRIORITY, POLL_PRIORITY
+from   Telemetry import Deadband, DeadbandFilter
 
 #Thingsboard Device Credentials
 THINGSBOARD_HOST = 'demo.thingsboard.io'
@@ -17,24 +19,69 @@ ClientConnected = 0
 #Create instance of ATX DaliHAt
 DaliHat = ATX_DaliHat('/dev/ttyS0')
 
-#Create instance of D111 Power Meter
-ME_D111 = LovatoD111(1,'/dev/ttyUSB0',0.5)
+#Every DALI transaction runs on the bus manager's worker thread,RPC requests ahead of background polling
+DaliBus = DaliBusManager(DaliHat)
+
+#RS-485 line shared by the D111 power meters.Polling may use at most half of the line time
+MeterBus = D111_Bus('/dev/ttyUSB0',0.5,BusBudget=0.5)
+
+#Modbus address of the D111 power meter
+ME_D111_ADD = 1
 #----------------------------Application Variables-------------------------------/
 #Frequency at which threads should run f=1/s
 SERVER_DASHBOARD_UPDATE = 5
 RECONNECTION_DELAY = 10
 PUBLISH_DELAY = 0.1
+SCHEDULER_STATS_UPDATE = 60
+POWER_SAMPLE_PERIOD = 1
+ENERGY_POLL_INTERVAL = 30
+DALI_RESCAN_AGE = 3600
+TELEMETRY_KEEP_ALIVE = 300
 
 #Addresses assigned to devices on the bus
 DALI_DIMMER_ADD = 0x00
 DALI_RELAY_ADD = 0x01
+DALI_DEVICES = (DALI_DIMMER_ADD,DALI_RELAY_ADD)
+
+#Shadow of the DALI device levels.Dashboard reads are answered from it & the bus is only read back in the background
+Shadow = DaliShadow(DaliHat)
+for DevAddress in DALI_DEVICES:
+    Shadow.Track(DevAddress)
+
+#Inventory of the devices on the DALI bus,kept on disk so it survives restarts.Each address is rescanned about once an hour
+DeviceTable = DaliDeviceTable(DaliHat,'DaliDevices.json')
 #/----------------------------JSON MESSAGES---------------------------------------/
 #Json Message for Dali Relay Status
 DaliRelayStatus = {'RelayStatus' : False}
 #Json Message for Dali Dimmer
 DaliDimmerLevel = {'BrightnessLevel' : 0}
-#Json Message for current,voltage & power measurements
+#Json Message for current,voltage & power measurements.Each measurement is published as the mean over the update window,
+#with its min,max & RMS alongside it
 PowerMonitoring = {'Voltage': 0 , 'Current': 0 , 'kWh' : 0 , 'Hz' : 0 , 'kW' : 0 , 'kVar' : 0 , 'PF' : 0 , 'Alarm State' : False}
+#Meter register behind each power monitoring measurement
+POWER_MONITORING_FIELDS = {'Voltage' : 'Voltage' , 'Current' : 'Current' , 'Hz' : 'Hz' , 'kW' : 'ActivePwr' , 'kVar' : 'ReactivePwr' , 'PF' : 'PwrFactor'}
+#Meter registers read on every sample,planned into as few block reads as possible
+POWER_MONITORING_REGISTERS = (D111_Registers.Voltage,D111_Registers.Current,D111_Registers.TotActEnergy,D111_Registers.ActivePwr,
+                              D111_Registers.Hz,D111_Registers.ReactivePwr,D111_Registers.PwrFactor,D111_Registers.ProgThresholdStatus)
+#Create instance of D111 Power Meter.Fast changing measurements are read on every sample,the energy total barely moves so it is
+#read less often.A meter that has stopped responding is backed off
+ME_D111 = MeterBus.AddMeter(ME_D111_ADD,POWER_SAMPLE_PERIOD,POWER_MONITORING_REGISTERS,{D111_Registers.TotActEnergy : ENERGY_POLL_INTERVAL})
+#Samples taken between dashboard updates,sized to hold a few update windows
+PowerHistory = D111_History(4 * SERVER_DASHBOARD_UPDATE // POWER_SAMPLE_PERIOD,POWER_MONITORING_REGISTERS)
+#Local Modbus TCP server sharing the latest meter readings with other processes on the Pi,so they stay off the RS-485 line.
+#Unit ids are the meters' Modbus addresses & readings older than a few samples are reported as unavailable
+MeterProxy = D111_Proxy(MeterBus.GetReading,'127.0.0.1',MaxAge=5 * POWER_SAMPLE_PERIOD)
+#/-----------------------Report By Exception-------------------------------------/
+#Change each power measurement must exceed before it is republished.The window min,max & RMS share the measurement's deadband
+POWER_DEADBANDS = {'Voltage' : Deadband(Absolute=1) , 'Current' : Deadband(Percent=2) , 'kWh' : Deadband(Absolute=0.01) , 'Hz' : Deadband(Absolute=0.05) ,
+                   'kW' : Deadband(Percent=2) , 'kVar' : Deadband(Percent=2) , 'PF' : Deadband(Absolute=0.01)}
+PowerFilter = DeadbandFilter({Key + Suffix : Band for Key,Band in POWER_DEADBANDS.items() for Suffix in ('',' Min',' Max',' RMS')},TELEMETRY_KEEP_ALIVE)
+#Dimmer level & relay state are reported whenever they change
+DimmerFilter = DeadbandFilter(KeepAlive=TELEMETRY_KEEP_ALIVE)
+RelayFilter = DeadbandFilter(KeepAlive=TELEMETRY_KEEP_ALIVE)
+#/-----------------------Scheduler Instrumentation---------------------------------/
+#Records per task run time & wakeup latency,published periodically to see which task is loading the Pi
+SchedulerStats = pyRTOS.SchedulerMonitor()
 #/-----------------------Function Declarations-------------------------------------/
 # The callback for when the client receives a CONNACK response from the server.
 def on_connect(client, userdata, rc, *extra_params):
@@ -46,11 +93,12 @@ def on_connect(client, userdata, rc, *extra_params):
     client.subscribe('v1/devices/me/rpc/request/+')
     
     #Update Relay Status and brightness level on connection
-    DaliRelayStatus['RelayStatus'] = GetRelayStatus()
-    client.publish('v1/devices/me/attributes',json.dumps(DaliRelayStatus),1)
+    WithFreshShadow(PublishDaliStatus)
     
-    DaliDimmerLevel['BrightnessLevel'] = DaliHat.QueryLevel(DALI_DIMMER_ADD)
-    client.publish('v1/devices/me/attributes',json.dumps(DaliDimmerLevel),1)
+    #Everything is republished in full after a reconnection
+    PowerFilter.Reset()
+    DimmerFilter.Reset()
+    RelayFilter.Reset()
     
     global ClientConnected
     ClientConnected = 1
@@ -79,44 +127,137 @@ def on_message(client, userdata, msg):
     #execute rpc's based on method in payload
     if data['method'] == 'SetDaliRelayState':
         print('Set Relay State Command Received')
-        DaliHat.SetDeviceState(DALI_RELAY_ADD,data['params'])
+        SubmitRPC(Shadow.SetDeviceState,DALI_RELAY_ADD,data['params'])
     
     #RPC used to set brightness level of dimmer switch
     if data['method'] == 'setBrightnessLevel':
         print('Set brightness level command received')
-        DaliHat.SetTargetLevel(DALI_DIMMER_ADD,data['params'])
+        SubmitRPC(Shadow.SetTargetLevel,DALI_DIMMER_ADD,data['params'])
+    
+    #RPC used to set the level of every device in a group with a single bus frame,params {"group" : 0-15 , "level" : 0-254}
+    if data['method'] == 'setGroupLevel':
+        print('Set group level command received')
+        SubmitRPC(Shadow.SetGroupLevel,data['params']['group'],data['params']['level'])
+    
+    #RPCs used to manage group membership,params {"address" : short address , "group" : 0-15}
+    if data['method'] == 'addToGroup':
+        print('Add to group command received')
+        SubmitRPC(Shadow.AddToGroup,data['params']['address'],data['params']['group'])
+    
+    if data['method'] == 'removeFromGroup':
+        print('Remove from group command received')
+        SubmitRPC(Shadow.RemoveFromGroup,data['params']['address'],data['params']['group'])
+    
+    #RPCs used to store & recall scenes,params {"scene" : 0-15 , "level" : 0-254 (store only)} plus an optional "address" or "group",
+    #all devices are targeted otherwise
+    if data['method'] == 'storeScene':
+        print('Store scene command received')
+        SubmitRPC(Shadow.StoreScene,RPC_TargetAddress(data['params']),data['params']['scene'],data['params']['level'])
+    
+    if data['method'] == 'recallScene':
+        print('Recall scene command received')
+        SubmitRPC(Shadow.RecallScene,RPC_TargetAddress(data['params']),data['params']['scene'])
+    
+    #RPC request used to list the devices found on the DALI bus,answered from the device table without touching the bus
+    if data['method'] == 'getDaliDevices':
+        print('DALI Device List Query Received')
+        client.publish('v1/devices/me/rpc/response/'+requestId,json.dumps([Device._asdict() for Device in DeviceTable.GetDevices()]),1)
     
     #RPC request used to get relay status from device
     if data['method'] == 'checkRelayStatus':
         print('Relay Status Query Received')
-        DaliRelayStatus['RelayStatus'] = GetRelayStatus()
-        client.publish('v1/devices/me/attributes',json.dumps(DaliRelayStatus),1)
-        client.publish('v1/devices/me/rpc/response/'+requestId,json.dumps(DaliRelayStatus['RelayStatus']),1)
+        WithFreshShadow(RespondRelayStatus,requestId)
 
     
     #RPC request used to get brightness level
     if data['method'] == 'checkBrightnessLevel':
         print('Dimmer Level Query Received')
-        DaliDimmerLevel['BrightnessLevel'] = DaliHat.QueryLevel(DALI_DIMMER_ADD)
-        client.publish('v1/devices/me/attributes',json.dumps(DaliDimmerLevel),1)
+        WithFreshShadow(PublishBrightnessLevel)
     
     #RPC request received from the server when dashboard is opened in an new window,ensures control knob starts from the correct position
     if data['method'] == 'getStartingBrightnessLevel':
         print('Dimmer Level First Query')
-        DaliDimmerLevel['BrightnessLevel'] = DaliHat.QueryLevel(DALI_DIMMER_ADD)
-        client.publish('v1/devices/me/rpc/response/'+requestId,json.dumps(DaliDimmerLevel['BrightnessLevel']),1)
+        WithFreshShadow(RespondBrightnessLevel,requestId)
+
 
+#DALI address targeted by an RPC,a group,a single device or every device on the bus
+def RPC_TargetAddress(params):
+    
+    if 'group' in params:
+        return DaliHat.GroupAddress(params['group'])
+    
+    if 'address' in params:
+        return params['address']
+    
+    return BROADCAST_ADDRESS
+
+#Queue a user request on the DALI bus ahead of background polling.Runs on the bus worker,so paho's network thread never waits on the bus
+def SubmitRPC(Function,*Args):
+    
+    Transaction = DaliBus.Submit(RPC_PRIORITY,Function,*Args)
+    Transaction.add_done_callback(ReportBusError)
+    
+    return Transaction
+
+def ReportBusError(Transaction):
+    
+    if Transaction.exception() is not None:
+        print('DALI transaction failed: ' + str(Transaction.exception()))
+
+#Run Function once the shadow holds fresh levels for the DALI devices.Runs straight away when it already does,so dashboard queries
+#never touch the bus,otherwise the stale devices are read back first as a DALI bus transaction
+def WithFreshShadow(Function,*Args):
+    
+    if all(Shadow.GetCachedLevel(DevAddress) is not None for DevAddress in DALI_DEVICES):
+        Function(*Args)
+    else:
+        SubmitRPC(RefreshShadow,Function,*Args)
+
+def RefreshShadow(Function,*Args):
+    
+    for DevAddress in DALI_DEVICES:
+        Shadow.GetLevel(DevAddress)
+    
+    Function(*Args)
+
+#The following publish the shadowed device state
+def PublishDaliStatus():
+    
+    DaliRelayStatus['RelayStatus'] = GetRelayStatus()
+    client.publish('v1/devices/me/attributes',json.dumps(DaliRelayStatus),1)
+    
+    PublishBrightnessLevel()
+
+def PublishBrightnessLevel():
+    
+    DaliDimmerLevel['BrightnessLevel'] = GetDimmerLevel()
+    client.publish('v1/devices/me/attributes',json.dumps(DaliDimmerLevel),1)
+
+def RespondRelayStatus(requestId):
+    
+    DaliRelayStatus['RelayStatus'] = GetRelayStatus()
+    client.publish('v1/devices/me/attributes',json.dumps(DaliRelayStatus),1)
+    client.publish('v1/devices/me/rpc/response/'+requestId,json.dumps(DaliRelayStatus['RelayStatus']),1)
+
+def RespondBrightnessLevel(requestId):
+    
+    DaliDimmerLevel['BrightnessLevel'] = GetDimmerLevel()
+    client.publish('v1/devices/me/rpc/response/'+requestId,json.dumps(DaliDimmerLevel['BrightnessLevel']),1)
 
 def GetRelayStatus():
     
-    #First we read the value in the DTR register
-    DTR0_Value  = DaliHat.QueryLevel(DALI_RELAY_ADD)
+    #Last known level of the relay,never touches the bus
+    RelayLevel = Shadow.GetCachedLevel(DALI_RELAY_ADD,math.inf)
     
-    #Next we determine discrete state i.e. either true(ON) or false(OFF) based on DTR value
-    if(DTR0_Value == 0) :
-        return False
-    elif(DTR0_Value == 254):
-        return True
+    #Relay is on at any level above 0,it is reported off until it has been read
+    return RelayLevel is not None and RelayLevel > 0
+
+def GetDimmerLevel():
+    
+    #Last known level of the dimmer,never touches the bus
+    DimmerLevel = Shadow.GetCachedLevel(DALI_DIMMER_ADD,math.inf)
+    
+    return 0 if DimmerLevel is None else DimmerLevel
     
     
 #This thread is used to reconnect to the server in the event of disconnection.If client disconnects from server,we attempt a reconnection
@@ -124,22 +265,117 @@ def GetRelayStatus():
         
 def MQTT_ConnectionManager(self):
     
+    #initialize() runs the task up to its first yield & discards it,so the first connect attempt must come after this one
+    yield
+    
     while True:
         if(ClientConnected == 0):
+            
+            #Connect to ThingsBoard using default MQTT port and 60 seconds keepalive interval,on a worker thread so that a slow connect does not stall other tasks
+            ConnectAttempt = pyRTOS.run_in_executor(client.connect,THINGSBOARD_HOST, 1883, 20)
+            yield [ConnectAttempt]
+            
             try:
-                #Connect to ThingsBoard using default MQTT port and 60 seconds keepalive interval
-                client.connect(THINGSBOARD_HOST, 1883, 20)
+                ConnectAttempt.result()
             except:
                 #Notify User that we are attempting reconnection
                 print("MQTT Connection Attempt Failed.Attempting reconnection in 5s")
         
-        yield [pyRTOS.timeout(RECONNECTION_DELAY)]
+        yield [self.next_period()]
+
+
+
+#Copy the group membership of the shadowed devices from the device table,reading it from the bus for devices the table has
+#no membership for.Until a device's membership is known,group commands mark its cached level stale.Runs on the DALI bus worker
+def SyncShadowGroups(Addresses=DALI_DEVICES):
+    
+    for DevAddress in Addresses:
+        
+        if DevAddress not in DALI_DEVICES:
+            continue
+        
+        Device = DeviceTable.Get(DevAddress)
+        if Device is not None and Device.Groups is not None:
+            Shadow.LoadGroups(DevAddress,Device.Groups)
+        else:
+            Shadow.RefreshGroups(DevAddress)
+
+#Reads state of DALI devices.Submitted to the DALI bus manager at polling priority
+def ReadSystemStatus():
+    
+    #Read back the device that has gone longest without confirmation,the rest are answered from the shadow
+    Shadow.Reconcile()
+    
+    #Keep the device table current one address at a time,along with the group membership of the shadowed devices
+    SyncShadowGroups(DeviceTable.Rescan(DALI_RESCAN_AGE,1))
+    
+    #Get Relay Status & Brightness Level
+    DaliDimmerLevel['BrightnessLevel'] = GetDimmerLevel()
+    DaliRelayStatus['RelayStatus'] = GetRelayStatus()
 
+#Summarise the power samples taken since the last dashboard update.Returns False if no samples were taken
+def UpdatePowerMonitoring():
+    
+    Window = PowerHistory.Aggregate(SERVER_DASHBOARD_UPDATE,time.time())
+    if Window is None:
+        return False
+    
+    for Key,Field in POWER_MONITORING_FIELDS.items():
+        if Window[Field] is not None:
+            PowerMonitoring[Key] = Window[Field]['Mean']
+            PowerMonitoring[Key + ' Min'] = Window[Field]['Min']
+            PowerMonitoring[Key + ' Max'] = Window[Field]['Max']
+            PowerMonitoring[Key + ' RMS'] = Window[Field]['RMS']
+    
+    #Energy is a running total & the alarm follows the latest sample,PowerSampler publishes alarm changes as they happen
+    if Window['TotActEnergy'] is not None:
+        PowerMonitoring['kWh'] = Window['TotActEnergy']['Max']
+    if Window['ProgThresholdStatus'] is not None and Window['ProgThresholdStatus']['Last'] is not None:
+        PowerMonitoring['Alarm State'] = Window['ProgThresholdStatus']['Last'] > 0
+    
+    return True
 
+#Publish the fields of a message that the filter reports as changed.A Partial message does not count as the filter's keep-alive
+def PublishChanges(Topic,Filter,Message,Partial=False):
+    
+    Report = Filter.Filter(Message,Partial=Partial)
+    
+    if Report:
+        ReportJSON = json.dumps(Report)
+        print(ReportJSON)
+        client.publish(Topic,ReportJSON,1)
+
+#Thread responsible for sampling the power meters into the history between dashboard updates
+def PowerSampler(self):
+    
+    #initialize() runs the task up to its first yield & discards it,so the first poll must come after this one
+    yield
+    
+    while True:
+        
+        #Poll the meters that are due on a worker thread.A meter that has stopped responding is backed off & adds no samples
+        Poll = pyRTOS.run_in_executor(MeterBus.PollDue)
+        yield [Poll]
+        
+        Readings = Poll.result()
+        if ME_D111_ADD in Readings:
+            #Only the registers read on this pass are recorded,the rest are left out of this sample
+            PowerHistory.Append(Readings[ME_D111_ADD])
+            
+            #Alarms are published as soon as they are sampled rather than waiting for the next dashboard update
+            AlarmState = Readings[ME_D111_ADD].ProgThresholdStatus
+            if(ClientConnected == 1) and AlarmState is not None and AlarmState != PowerMonitoring['Alarm State']:
+                PowerMonitoring['Alarm State'] = AlarmState
+                PublishChanges('v1/devices/me/telemetry',PowerFilter,{'Alarm State' : AlarmState},Partial=True)
+        
+        yield [self.next_period()]
 
 #Thread responsible for monitoring & publishing system voltage,current,power consumption + state of all DALI devices on the bus
 def DALI_SysMonitor(self):
 
+    #Let the scheduler release the first job rather than initialize()
+    yield
+    
     while True:
         
         try:
@@ -147,39 +383,38 @@ def DALI_SysMonitor(self):
             if(ClientConnected == 1):
                 
                  print("[...System Status...]")
-                 #Read System Power Consumption
-                 PowerMonitoring['Voltage'] = ME_D111.GetVoltage()
-                 PowerMonitoring['Current'] = ME_D111.GetCurrent()
-                 PowerMonitoring['kWh'] = ME_D111.GetActiveEnergy()
-                 PowerMonitoring['kW'] = ME_D111.GetActivePwr()
-                 PowerMonitoring['Hz'] = ME_D111.GetFrequency()
-                 PowerMonitoring['kVar'] = ME_D111.GetReactivePwr()
-                 PowerMonitoring['PF'] = ME_D111.GetPwrFactor()
-                 PowerMonitoring['Alarm State'] = ME_D111.GetProgThresholdStatus()
-                
-                 #Get Relay Status & Brightness Level
-                 DaliDimmerLevel['BrightnessLevel'] = DaliHat.QueryLevel(DALI_DIMMER_ADD)
-                 DaliRelayStatus['RelayStatus'] = GetRelayStatus()
-             
-                 #Convert python objects to JSON strings before publishing
-                 PowerMonitoringJSON = json.dumps(PowerMonitoring)
-                 DaliDimmerLevelJSON  = json.dumps(DaliDimmerLevel)
-                 DaliRelayStatusJSON  = json.dumps(DaliRelayStatus)
                  
-                 #print latest values
-                 print(PowerMonitoringJSON)
-                 print(DaliDimmerLevelJSON)
-                 print(DaliRelayStatusJSON)
-                
-                 #Publish updated attributes
-                 client.publish('v1/devices/me/telemetry',PowerMonitoringJSON,1)
-                 client.publish('v1/devices/me/attributes',DaliDimmerLevelJSON,1)
-                 client.publish('v1/devices/me/attributes',DaliRelayStatusJSON,1)
+                 #Read system status on the DALI bus worker.Only this task blocks while the bus transactions complete
+                 StatusRead = DaliBus.Submit(POLL_PRIORITY,ReadSystemStatus)
+                 yield [pyRTOS.wait_for_future(StatusRead)]
+                 StatusRead.result()
                  
-            yield [pyRTOS.timeout(SERVER_DASHBOARD_UPDATE)]
+                 #Only the aggregates of the samples taken since the last update are published
+                 PowerSampled = UpdatePowerMonitoring()
+             
+                 #Publish only the fields that changed beyond their deadband,plus a periodic keep-alive
+                 if PowerSampled:
+                     PublishChanges('v1/devices/me/telemetry',PowerFilter,PowerMonitoring)
+                 PublishChanges('v1/devices/me/attributes',DimmerFilter,DaliDimmerLevel)
+                 PublishChanges('v1/devices/me/attributes',RelayFilter,DaliRelayStatus)
+                 
+            yield [self.next_period()]
         
         except Exception as e:
             raise e
+#Thread responsible for publishing scheduler statistics
+def SchedulerStatsPublisher(self):
+    
+    #Let the scheduler release the first job rather than initialize()
+    yield
+    
+    while True:
+        
+        #Only publish if mqtt connection is established
+        if(ClientConnected == 1):
+            client.publish('v1/devices/me/telemetry',json.dumps({'SchedulerStats' : SchedulerStats.snapshot()}),1)
+        
+        yield [self.next_period()]
 #/-----------------------------------THINGSBOARD Setup & Configuration-----------------/
 #Create instance of MQTT client
 client = mqtt.Client()
@@ -200,12 +435,30 @@ DaliHat.PrintDALI_HatVersionInfo()
 #Print ATX DALI bus status
 DaliHat.GetDALI_BusStatus()
 
-#Add threads to scheduler
-pyRTOS.add_task(pyRTOS.Task(MQTT_ConnectionManager,6, name="MQTT_ConnManager", mailbox=False))
-pyRTOS.add_task(pyRTOS.Task(DALI_SysMonitor,4, name="DALI_SysMonitor", mailbox=False))
+#Add threads to scheduler,each released at a fixed period so that dashboard updates do not drift
+pyRTOS.add_task(pyRTOS.PeriodicTask(MQTT_ConnectionManager,RECONNECTION_DELAY,priority=6, name="MQTT_ConnManager", mailbox=False))
+pyRTOS.add_task(pyRTOS.PeriodicTask(PowerSampler,POWER_SAMPLE_PERIOD,priority=3, name="PowerSampler", mailbox=False))
+pyRTOS.add_task(pyRTOS.PeriodicTask(DALI_SysMonitor,SERVER_DASHBOARD_UPDATE,priority=4, name="DALI_SysMonitor", mailbox=False))
+pyRTOS.add_task(pyRTOS.PeriodicTask(SchedulerStatsPublisher,SCHEDULER_STATS_UPDATE,priority=8, name="SchedulerStats", mailbox=False))
 
 # Startx Client Loop
 client.loop_start()
 
-#Start the RTOS
-pyRTOS.start()
\ No newline at end of file
+#Start the DALI bus worker
+DaliBus.Start()
+
+#Scan the whole DALI bus on first start,afterwards the device table is kept up to date by incremental rescans.
+#Each address is its own bus transaction so RPC requests are served between them instead of waiting for the whole scan
+if not DeviceTable.IsScanned():
+    for DevAddress in range(MIN_SHORT_ADDRESS,MAX_SHORT_ADDRESS):
+        DaliBus.Submit(POLL_PRIORITY,DeviceTable.ScanDevice,DevAddress).add_done_callback(ReportBusError)
+    DaliBus.Submit(POLL_PRIORITY,DeviceTable.Save).add_done_callback(ReportBusError)
+
+#Learn which groups the shadowed devices belong to,groups configured before this run would otherwise leave their levels wrong
+DaliBus.Submit(POLL_PRIORITY,SyncShadowGroups).add_done_callback(ReportBusError)
+
+#Start serving meter readings to local readers
+MeterProxy.Start()
+
+#Start the RTOS,sleeping between task deadlines rather than spinning.Earliest deadline first scheduling keeps periodic releases on time
+pyRTOS.start(scheduler=pyRTOS.EDFScheduler(),tickless=True,monitor=SchedulerStats)
\ No newline at end of file
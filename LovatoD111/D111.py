@@ -1,6 +1,15 @@
 import minimalmodbus
+import struct
+import time
+from   collections import namedtuple
 from   enum import IntEnum
 
+#NumPy is only needed to decode batches of readings at once
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 #Serial Configuration Parameters 
 D111_DEFAULT_BAUDRATE   = 9600                #Baudrate of serial port connected to USB-to-RS485 converter 
 MODBUS_MODE             = 'rtu'               #Modbus mode can be either 'rtu' OR 'ascii'
@@ -10,6 +19,13 @@ DBG_ENABLED             = False                #Modbus debug prints can be set t
 Word = 1
 DoubleWord = 2
 
+#Maximum number of registers returned by a single Modbus read
+MAX_BLOCK_REGISTERS = 125
+
+#Largest run of unrequested registers that is read through rather than starting another transaction.At 9600 baud each register costs
+#roughly 2ms on the wire,whereas every extra transaction adds request/response framing,CRC & the meter's turnaround time
+MAX_BLOCK_GAP = 16
+
 #D111 Register Names
 class D111_Registers(IntEnum):
     Voltage = 1
@@ -28,6 +44,138 @@ class D111_Registers(IntEnum):
     PartialHrCounter = 7681
     ProgThresholdStatus = 8719
 
+#Layout of each measurement.Width is in registers,32-bit values are sent high word first.The raw value is divided by Scale to give
+#engineering units,registers without a unit are status flags
+D111_RegisterSpec = namedtuple('D111_RegisterSpec',['Address','Width','Signed','Scale','Unit'])
+
+D111_RegisterMap = {
+    D111_Registers.Voltage : D111_RegisterSpec(D111_Registers.Voltage,DoubleWord,False,100,'V'),
+    D111_Registers.Current : D111_RegisterSpec(D111_Registers.Current,DoubleWord,False,1000,'A'),
+    D111_Registers.ActivePwr : D111_RegisterSpec(D111_Registers.ActivePwr,DoubleWord,True,100,'kW'),
+    D111_Registers.ReactivePwr : D111_RegisterSpec(D111_Registers.ReactivePwr,DoubleWord,True,100,'kvar'),
+    D111_Registers.PwrFactor : D111_RegisterSpec(D111_Registers.PwrFactor,DoubleWord,True,100,''),
+    D111_Registers.Hz : D111_RegisterSpec(D111_Registers.Hz,DoubleWord,False,10,'Hz'),
+    D111_Registers.AvgKW_Pwr : D111_RegisterSpec(D111_Registers.AvgKW_Pwr,DoubleWord,True,10000,'kW'),
+    D111_Registers.MaxAvgKW_Pwr : D111_RegisterSpec(D111_Registers.MaxAvgKW_Pwr,DoubleWord,True,10000,'kW'),
+    D111_Registers.TotActEnergy : D111_RegisterSpec(D111_Registers.TotActEnergy,DoubleWord,False,1000,'kWh'),
+    D111_Registers.TotReactEnergy : D111_RegisterSpec(D111_Registers.TotReactEnergy,DoubleWord,False,1000,'kvarh'),
+    D111_Registers.PartialActEnergy : D111_RegisterSpec(D111_Registers.PartialActEnergy,DoubleWord,False,1000,'kWh'),
+    D111_Registers.PartialReactEnergy : D111_RegisterSpec(D111_Registers.PartialReactEnergy,DoubleWord,False,1000,'kvarh'),
+    D111_Registers.HrCounter : D111_RegisterSpec(D111_Registers.HrCounter,DoubleWord,False,1,'h'),
+    D111_Registers.PartialHrCounter : D111_RegisterSpec(D111_Registers.PartialHrCounter,DoubleWord,False,1,'h'),
+    D111_Registers.ProgThresholdStatus : D111_RegisterSpec(D111_Registers.ProgThresholdStatus,Word,False,1,None),
+}
+
+#struct format of each register layout as (Width,Signed)
+D111_StructFormats = {
+    (Word,False) : 'H',
+    (Word,True) : 'h',
+    (DoubleWord,False) : 'I',
+    (DoubleWord,True) : 'i',
+}
+
+#Immutable set of measurements taken in one poll.Measurements that were not requested are None,Timestamp is time.time() of the poll
+D111_Snapshot = namedtuple('D111_Snapshot',[Register.name for Register in D111_Registers] + ['Timestamp'])
+D111_Snapshot.__new__.__defaults__ = (None,) * len(D111_Snapshot._fields)
+
+#Registers read by ReadSnapshot() when none are specified
+D111_ALL_REGISTERS = tuple(D111_Registers)
+
+def PlanBlockReads(Registers,MaxGap=MAX_BLOCK_GAP):
+    
+    #Walk the requested registers in address order,extending the current block over small gaps & starting a new block otherwise
+    Blocks = []
+    
+    for Register in sorted(set(Registers)):
+        
+        End = Register + D111_RegisterMap[Register].Width
+        
+        if Blocks and (Register - Blocks[-1][1]) <= MaxGap and (End - Blocks[-1][0]) <= MAX_BLOCK_REGISTERS:
+            Blocks[-1][1] = max(Blocks[-1][1],End)
+            Blocks[-1][2].append(Register)
+        else:
+            Blocks.append([Register,End,[Register]])
+    
+    #Each block is returned as (start address,number of registers,registers contained in block)
+    return [(Start,End - Start,tuple(BlockRegisters)) for Start,End,BlockRegisters in Blocks]
+
+#Decoder compiled once for a planned block read.The block's words are packed into a reusable byte buffer & every measurement in
+#the block is unpacked by a single precompiled struct,skipping over the unrequested registers in between
+class D111_BlockDecoder():
+
+        def __init__(self,Start,Count,Registers):
+            
+            self.Start = Start
+            self.Count = Count
+            self.Registers = Registers
+            
+            Format = '>'
+            Position = Start
+            
+            for Register in Registers:
+                Spec = D111_RegisterMap[Register]
+                Format += 'x' * (2 * (Register - Position)) + D111_StructFormats[(Spec.Width,Spec.Signed)]
+                Position = Register + Spec.Width
+            
+            self.WordStruct = struct.Struct('>' + 'H' * Count)
+            self.ValueStruct = struct.Struct(Format)
+            self.Buffer = bytearray(self.WordStruct.size)
+            self.View = memoryview(self.Buffer)
+            
+            #(name,scale,is status flag) of every value unpacked from the block
+            self.Fields = [(Register.name,D111_RegisterMap[Register].Scale,D111_RegisterMap[Register].Unit is None) for Register in Registers]
+            
+        def Decode(self,Words,Values):
+            
+            self.WordStruct.pack_into(self.Buffer,0,*Words)
+            
+            for (Name,Scale,IsFlag),Raw in zip(self.Fields,self.ValueStruct.unpack_from(self.View)):
+                Values[Name] = (Raw > 0) if IsFlag else Raw/Scale
+            
+            return Values
+
+def DecodeBatch(Registers,RawReadings):
+    
+    #Decode many raw readings of the same registers (see LovatoD111.ReadRaw) at once,returning a column per measurement.
+    #Columns are NumPy arrays when NumPy is available & lists otherwise
+    Plan = PlanBlockReads(Registers)
+    Columns = {}
+    
+    if np is None:
+        Decoders = [D111_BlockDecoder(*Block) for Block in Plan]
+        Rows = []
+        for RawReading in RawReadings:
+            Values = {}
+            for Decoder,Words in zip(Decoders,RawReading):
+                Decoder.Decode(Words,Values)
+            Rows.append(Values)
+        for Start,Count,BlockRegisters in Plan:
+            for Register in BlockRegisters:
+                Columns[Register.name] = [Values[Register.name] for Values in Rows]
+        return Columns
+    
+    for Index,(Start,Count,BlockRegisters) in enumerate(Plan):
+        
+        #One row per reading,one column per register in the block
+        Words = np.array([RawReading[Index] for RawReading in RawReadings],dtype=np.uint16).reshape(-1,Count)
+        
+        for Register in BlockRegisters:
+            Spec = D111_RegisterMap[Register]
+            Offset = Register - Start
+            
+            if Spec.Width == DoubleWord:
+                Raw = (Words[:,Offset].astype(np.uint32) << 16) | Words[:,Offset + 1]
+                if Spec.Signed:
+                    Raw = Raw.view(np.int32)
+            else:
+                Raw = Words[:,Offset]
+                if Spec.Signed:
+                    Raw = Raw.view(np.int16)
+            
+            Columns[Register.name] = (Raw > 0) if Spec.Unit is None else Raw/Spec.Scale
+    
+    return Columns
+
 class LovatoD111():
 
         def __init__(self,D111_ModBusAdd,USB_SerialPortName,SerialTimeout):
@@ -37,117 +185,89 @@ class LovatoD111():
             self.Lovato_D111.serial.baudrate = D111_DEFAULT_BAUDRATE
             self.Lovato_D111.serial.timeout = SerialTimeout
             
-
-        def GetActiveEnergy(self):
+            #Block read plans are cached per set of requested registers
+            self.BlockPlans = {}
             
-            #Read out contents of 2-byte register containing total active energy measurement
-            PowerArr = self.Lovato_D111.read_registers(D111_Registers.TotActEnergy,DoubleWord)
+        def PlanFor(self,Registers):
             
-            #Bitwise logic for combining two bytes to form 16-bit integer
-            Power = PowerArr[0]
-            Power = (Power << 8) | PowerArr[1]
-         
-            #Divide by 1000 to convert to kWh
-            return Power/1000
+            #Plan the fewest block reads covering the requested registers & compile their decoders,once per distinct request
+            Plan = self.BlockPlans.get(Registers)
+            if Plan is None:
+                Plan = self.BlockPlans[Registers] = [D111_BlockDecoder(*Block) for Block in PlanBlockReads(Registers)]
+            
+            return Plan
             
+        def ReadRegister(self,Register):
+            
+            #Read out a single measurement in engineering units
+            return getattr(self.ReadSnapshot((Register,)),Register.name)
+            
+        def ReadRaw(self,Registers=D111_ALL_REGISTERS):
+            
+            #Read out the undecoded words of every planned block,for decoding in batches with DecodeBatch()
+            return [self.Lovato_D111.read_registers(Decoder.Start,Decoder.Count) for Decoder in self.PlanFor(tuple(Registers))]
+            
+        def ReadSnapshot(self,Registers=D111_ALL_REGISTERS):
+            
+            Values = {}
+            Timestamp = time.time()
+            
+            #Read out each block in a single transaction & decode every requested measurement from it
+            for Decoder in self.PlanFor(tuple(Registers)):
+                Decoder.Decode(self.Lovato_D111.read_registers(Decoder.Start,Decoder.Count),Values)
+            
+            return D111_Snapshot(Timestamp=Timestamp,**Values)
 
-        def GetVoltage(self):
-         
-            #Read out contents of 2-byte(Double Word) register containing most recent voltage measurement
-            VoltageArr = self.Lovato_D111.read_registers(D111_Registers.Voltage,DoubleWord)
+        def GetActiveEnergy(self):
             
-            #Bitwise logic for combining two bytes to form 16-bit integer
-            Voltage = VoltageArr[0]
-            Voltage = (Voltage << 8) | VoltageArr[1]
+            #Read out total active energy measurement in kWh
+            return self.ReadRegister(D111_Registers.TotActEnergy)
+
+        def GetVoltage(self):
          
-            #Dividing by 100 as spec'd in datasheet
-            return Voltage/100
+            #Read out most recent voltage measurement
+            return self.ReadRegister(D111_Registers.Voltage)
 
         def GetCurrent(self):
 
-            #Read out contents of 2-byte(Double Word) register containing most recent current measurement
-            CurrentArr = self.Lovato_D111.read_registers(D111_Registers.Current,DoubleWord)
-         
-            #Divide result by 1000 to convert to amperes
-            Current = CurrentArr[1]/1000
-         
-            return Current
+            #Read out most recent current measurement in amperes
+            return self.ReadRegister(D111_Registers.Current)
 
         def GetActivePwr(self):
 
-            #Divide by 100 to convert to KW
-            ActivePwrArr = self.Lovato_D111.read_registers(D111_Registers.ActivePwr,DoubleWord)
-            
-            #Bitwise logic for combining two bytes to form 16-bit integer
-            ActivePwr = ActivePwrArr[0]
-            ActivePwr = (ActivePwr << 8) | ActivePwrArr[1]
-            
-            return ActivePwr/100
+            #Read out most recent active power measurement in KW
+            return self.ReadRegister(D111_Registers.ActivePwr)
 
         def GetReactivePwr(self):
          
-            #Divide by 100 to convert to KVar
-            ReactivePwrArr = self.Lovato_D111.read_registers(D111_Registers.ReactivePwr,DoubleWord)
-            
-            #Bitwise logic for combining two bytes to form 16-bit integer
-            ReactivePwr = ReactivePwrArr[0]
-            ReactivePwr = (ReactivePwr << 8) | ReactivePwrArr[1]
-            
-            return ReactivePwr/100
+            #Read out most recent reactive power measurement in KVar
+            return self.ReadRegister(D111_Registers.ReactivePwr)
 
         def GetPwrFactor(self):
          
-            PwrFactorArr = self.Lovato_D111.read_registers(D111_Registers.PwrFactor,DoubleWord)
-            
-            #Bitwise logic for combining two bytes to form 16-bit integer
-            PwrFactor = PwrFactorArr[0]
-            PwrFactor = (PwrFactor << 8) | PwrFactorArr[1]
-                   
-            return PwrFactor/100
+            return self.ReadRegister(D111_Registers.PwrFactor)
 
         def GetFrequency(self):
             
-            #Divide by 10 to get frequency
-            HzArr = self.Lovato_D111.read_registers(D111_Registers.Hz,DoubleWord)
-            
-            #Bitwise logic for combining two bytes to form 16-bit integer
-            Hz = HzArr[0]
-            Hz = (Hz << 8) | HzArr[1]
-            
-            return Hz/10
+            return self.ReadRegister(D111_Registers.Hz)
 
         def GetHourCounter(self):
             
-            HourCounter = self.Lovato_D111.read_registers(D111_Registers.HrCounter,DoubleWord)
-            
-            return HourCounter
+            return self.ReadRegister(D111_Registers.HrCounter)
 
         def GetPartialHourCounter(self):
             
-            PartialHourCounter = self.Lovato_D111.read_registers(D111_Registers.PartialHrCounter,DoubleWord)
-            
-            return PartialHourCounter
+            return self.ReadRegister(D111_Registers.PartialHrCounter)
 
         def GetAvgKW_Pwr(self):
             
-            #Divide by 10000 to convert to kW
-            AvgKW_Pwr = self.Lovato_D111.read_registers(D111_Registers.AvgKW_Pwr,DoubleWord)/10000
-            
-            return AvgKW_Pwr
+            return self.ReadRegister(D111_Registers.AvgKW_Pwr)
 
         def GetMaxAvgKW_Pwr(self):
             
-            #Divide by 10000 to convert to kW
-            MaxAvgKW_Pwr = self.Lovato_D111.read_registers(D111_Registers.MaxAvgKW_Pwr,DoubleWord)/10000
-            
-            return MaxAvgKW_Pwr
+            return self.ReadRegister(D111_Registers.MaxAvgKW_Pwr)
 
         def GetProgThresholdStatus(self):
 
-            ThresholdExceeded = self.Lovato_D111.read_registers(D111_Registers.ProgThresholdStatus,Word)
-            
             #Any value greater than 0 indicates that an alarm has been raised
-            if(ThresholdExceeded[0] > 0):
-                return True
-            
-            return False
+            return self.ReadRegister(D111_Registers.ProgThresholdStatus)
@@ -0,0 +1,244 @@
+import asyncio
+import serial
+import struct
+import time
+from   .D111 import LovatoD111, D111_Registers, D111_Snapshot, D111_ALL_REGISTERS, D111_DEFAULT_BAUDRATE
+
+#Modbus function codes
+READ_HOLDING_REGISTERS = 0x03
+EXCEPTION_FLAG = 0x80
+
+#Length of a Modbus exception reply,address + function + exception code + CRC
+EXCEPTION_RESPONSE_LENGTH = 5
+
+#Bits on the wire per character,1 start + 8 data + 1 parity/stop + 1 stop
+BITS_PER_CHAR = 11
+
+#Above 19200 baud the spec fixes the inter-frame gap rather than scaling it with the character time
+FIXED_FRAME_GAP_BAUDRATE = 19200
+FIXED_FRAME_GAP = 0.00175
+
+def _BuildCRC_Table():
+    
+    Table = []
+    for Byte in range(256):
+        CRC = Byte
+        for Bit in range(8):
+            CRC = (CRC >> 1) ^ 0xA001 if CRC & 1 else CRC >> 1
+        Table.append(CRC)
+    return Table
+
+CRC_TABLE = _BuildCRC_Table()
+
+def ModbusCRC(Data):
+    
+    #CRC-16/MODBUS,transmitted low byte first
+    CRC = 0xFFFF
+    for Byte in Data:
+        CRC = (CRC >> 8) ^ CRC_TABLE[(CRC ^ Byte) & 0xFF]
+    return CRC
+
+#Raised when a meter does not answer within the serial timeout
+class D111_NoResponseError(IOError):
+    pass
+
+#Raised on a corrupt,truncated or unexpected reply
+class D111_InvalidResponseError(IOError):
+    pass
+
+#Raised when the meter answers with a Modbus exception response
+class D111_SlaveError(IOError):
+    pass
+
+#One USB-to-RS485 adapter.Transactions on the same port are serialized,transactions on different ports run concurrently.
+#A reply of known length ends as soon as it has arrived instead of waiting out a fixed timeout.The 3.5 character silence defined
+#for Modbus RTU only delimits replies of unknown length,USB adapter latency can split a reply by more than that
+class D111_AsyncPort():
+
+        def __init__(self,USB_SerialPortName,SerialTimeout,Baudrate=D111_DEFAULT_BAUDRATE):
+            
+            #Non-blocking port,reads are driven by the event loop
+            self.Serial = serial.Serial(USB_SerialPortName,Baudrate,bytesize=8,parity=serial.PARITY_NONE,stopbits=1,timeout=0)
+            self.SerialTimeout = SerialTimeout
+            
+            if Baudrate <= FIXED_FRAME_GAP_BAUDRATE:
+                self.FrameGap = 3.5 * BITS_PER_CHAR / Baudrate
+            else:
+                self.FrameGap = FIXED_FRAME_GAP
+            
+            self.CharTime = BITS_PER_CHAR / Baudrate
+            self.Lock = asyncio.Lock()
+            
+            #End of the last frame seen on the line,the next request must not start within FrameGap of it
+            self.LineIdleAt = 0
+            
+        async def Transaction(self,Request,ResponseLength=None):
+            
+            async with self.Lock:
+                
+                Wait = self.LineIdleAt + self.FrameGap - time.monotonic()
+                if Wait > 0:
+                    await asyncio.sleep(Wait)
+                
+                self.Serial.reset_input_buffer()
+                self.Serial.write(Request)
+                
+                #The reply cannot start before the request has left the UART
+                Response = await self.ReadFrame(self.SerialTimeout + len(Request) * self.CharTime,ResponseLength)
+                self.LineIdleAt = time.monotonic()
+                
+                return Response
+            
+        async def ReadFrame(self,Timeout,ResponseLength=None):
+            
+            Loop = asyncio.get_running_loop()
+            FileNo = self.Serial.fileno()
+            Frame = bytearray()
+            Arrived = asyncio.Event()
+            
+            def OnReadable():
+                Frame.extend(self.Serial.read(self.Serial.in_waiting or 1))
+                Arrived.set()
+            
+            Loop.add_reader(FileNo,OnReadable)
+            
+            #A reply of known length must have fully arrived by the time its last character is due
+            if ResponseLength is not None:
+                Deadline = Loop.time() + Timeout + ResponseLength * self.CharTime
+            
+            try:
+                #Wait up to the serial timeout for the first byte.After that a reply of known length is read until it is complete,
+                #any other frame ends at the first silent gap
+                while True:
+                    Arrived.clear()
+                    try:
+                        await asyncio.wait_for(Arrived.wait(),Timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    
+                    if ResponseLength is None:
+                        Timeout = self.FrameGap
+                        continue
+                    
+                    if len(Frame) >= 2 and Frame[1] & EXCEPTION_FLAG:
+                        Expected = EXCEPTION_RESPONSE_LENGTH
+                    else:
+                        Expected = ResponseLength
+                    
+                    Timeout = Deadline - Loop.time()
+                    if len(Frame) >= Expected or Timeout <= 0:
+                        break
+            finally:
+                Loop.remove_reader(FileNo)
+            
+            return bytes(Frame)
+            
+        def Close(self):
+            
+            self.Serial.close()
+
+#Asyncio counterpart of LovatoD111 with the same getters as coroutines
+class AsyncLovatoD111():
+
+        def __init__(self,D111_ModBusAdd,Port):
+            
+            self.D111_ModBusAdd = D111_ModBusAdd
+            self.Port = Port
+            
+            #Block read plans are cached per set of requested registers
+            self.BlockPlans = {}
+            
+        #Block reads are planned exactly as for the synchronous driver
+        PlanFor = LovatoD111.PlanFor
+            
+        async def ReadRegisters(self,Start,Count):
+            
+            Request = bytearray(struct.pack('>BBHH',self.D111_ModBusAdd,READ_HOLDING_REGISTERS,Start,Count))
+            Request += struct.pack('<H',ModbusCRC(Request))
+            
+            Response = await self.Port.Transaction(Request,5 + 2 * Count)
+            
+            if not Response:
+                raise D111_NoResponseError("No response from meter " + str(self.D111_ModBusAdd))
+            
+            if len(Response) < 5 or ModbusCRC(Response) != 0:
+                raise D111_InvalidResponseError("Corrupt response from meter " + str(self.D111_ModBusAdd) + ": " + Response.hex())
+            
+            if Response[0] != self.D111_ModBusAdd:
+                raise D111_InvalidResponseError("Response from wrong slave " + str(Response[0]))
+            
+            if Response[1] == READ_HOLDING_REGISTERS | EXCEPTION_FLAG:
+                raise D111_SlaveError("Meter " + str(self.D111_ModBusAdd) + " returned exception code " + str(Response[2]))
+            
+            if Response[1] != READ_HOLDING_REGISTERS or Response[2] != 2 * Count or len(Response) != 5 + 2 * Count:
+                raise D111_InvalidResponseError("Unexpected response from meter " + str(self.D111_ModBusAdd) + ": " + Response.hex())
+            
+            return struct.unpack_from('>' + 'H' * Count,Response,3)
+            
+        async def ReadSnapshot(self,Registers=D111_ALL_REGISTERS):
+            
+            Values = {}
+            Timestamp = time.time()
+            
+            for Decoder in self.PlanFor(tuple(Registers)):
+                Decoder.Decode(await self.ReadRegisters(Decoder.Start,Decoder.Count),Values)
+            
+            return D111_Snapshot(Timestamp=Timestamp,**Values)
+            
+        async def ReadRegister(self,Register):
+            
+            return getattr(await self.ReadSnapshot((Register,)),Register.name)
+
+        async def GetActiveEnergy(self):
+            
+            return await self.ReadRegister(D111_Registers.TotActEnergy)
+
+        async def GetVoltage(self):
+            
+            return await self.ReadRegister(D111_Registers.Voltage)
+
+        async def GetCurrent(self):
+            
+            return await self.ReadRegister(D111_Registers.Current)
+
+        async def GetActivePwr(self):
+            
+            return await self.ReadRegister(D111_Registers.ActivePwr)
+
+        async def GetReactivePwr(self):
+            
+            return await self.ReadRegister(D111_Registers.ReactivePwr)
+
+        async def GetPwrFactor(self):
+            
+            return await self.ReadRegister(D111_Registers.PwrFactor)
+
+        async def GetFrequency(self):
+            
+            return await self.ReadRegister(D111_Registers.Hz)
+
+        async def GetHourCounter(self):
+            
+            return await self.ReadRegister(D111_Registers.HrCounter)
+
+        async def GetPartialHourCounter(self):
+            
+            return await self.ReadRegister(D111_Registers.PartialHrCounter)
+
+        async def GetAvgKW_Pwr(self):
+            
+            return await self.ReadRegister(D111_Registers.AvgKW_Pwr)
+
+        async def GetMaxAvgKW_Pwr(self):
+            
+            return await self.ReadRegister(D111_Registers.MaxAvgKW_Pwr)
+
+        async def GetProgThresholdStatus(self):
+            
+            return await self.ReadRegister(D111_Registers.ProgThresholdStatus)
+
+async def ReadSnapshots(Meters,Registers=D111_ALL_REGISTERS):
+    
+    #Poll every meter at once.Meters sharing a port queue on its lock,meters on different ports are read in parallel.
+    #A failed meter's exception is returned in its place so it does not cancel the others
+    return await asyncio.gather(*(Meter.ReadSnapshot(Registers) for Meter in Meters),return_exceptions=True)
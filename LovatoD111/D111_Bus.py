@@ -0,0 +1,212 @@
+import threading
+import time
+from   .D111 import LovatoD111, D111_ALL_REGISTERS, D111_DEFAULT_BAUDRATE, D111_Snapshot, PlanBlockReads
+
+#Backoff applied to a meter that stops responding,doubled on every consecutive failure up to the maximum
+MIN_BACKOFF = 1
+MAX_BACKOFF = 60
+
+#A register is read early if it falls due within this fraction of its interval,so reads due in the same tick are merged
+DUE_TOLERANCE = 0.1
+
+#Bus time estimate for one read transaction: 8 byte request,5 byte + data response,11 bits per character,
+#a 3.5 character gap after each frame & the meter's turnaround time
+BITS_PER_CHAR = 11
+REQUEST_BYTES = 8
+RESPONSE_OVERHEAD_BYTES = 5
+METER_TURNAROUND = 0.01
+
+#Largest burst of unused bus budget that can be saved up,in seconds of wall time.A block costing more than the largest burst
+#is read once the credit is full & leaves the credit negative,so it is paid back before the next read
+MAX_BUDGET_BURST = 1
+
+def EstimateReadTime(Count,Baudrate=D111_DEFAULT_BAUDRATE):
+    
+    #Seconds of line time taken by reading Count registers in one transaction
+    Chars = REQUEST_BYTES + RESPONSE_OVERHEAD_BYTES + 2 * Count + 2 * 3.5
+    return Chars * BITS_PER_CHAR / Baudrate + METER_TURNAROUND
+
+#Polling state kept for each meter on the bus.Every register has its own interval
+class D111_BusMeter():
+
+        def __init__(self,Meter,Intervals):
+            
+            self.Meter = Meter
+            self.Intervals = Intervals
+            
+            #Time at which each register is next due,a new meter is due immediately
+            self.NextDue = dict.fromkeys(Intervals,0)
+            
+            #Consecutive failed polls,used to back off dead meters
+            self.Failures = 0
+            self.LastError = None
+            self.BackoffUntil = 0
+            
+            #Most recent value of every register.Timestamp is that of the last successful poll
+            self.Reading = None
+            
+        def DueRegisters(self,Now):
+            
+            return [Register for Register,Due in self.NextDue.items() if Due <= Now + self.Intervals[Register] * DUE_TOLERANCE]
+            
+        def NextPoll(self):
+            
+            return max(min(self.NextDue.values()),self.BackoffUntil)
+
+#Owns a single RS-485 line shared by several daisy-chained D111 meters & serializes every transaction on it.
+#BusBudget is the fraction of line time polling may use,None for no limit.When the budget runs short the registers with
+#the shortest intervals are read first & the rest stay due until the next pass
+class D111_Bus():
+
+        def __init__(self,USB_SerialPortName,SerialTimeout,Baudrate=D111_DEFAULT_BAUDRATE,BusBudget=None):
+            
+            self.USB_SerialPortName = USB_SerialPortName
+            self.SerialTimeout = SerialTimeout
+            self.Baudrate = Baudrate
+            self.BusBudget = BusBudget
+            
+            #Only one transaction may be on the line at a time
+            self.BusLock = threading.Lock()
+            
+            #Meters in polling order,keyed by Modbus address
+            self.Meters = {}
+            self.PollOrder = []
+            
+            #Position in PollOrder at which the next round-robin pass starts
+            self.NextIndex = 0
+            
+            #Line time available to polling,refilled at BusBudget seconds per second
+            self.BudgetCredit = 0 if BusBudget is None else BusBudget * MAX_BUDGET_BURST
+            self.BudgetUpdated = time.monotonic()
+            
+            #Estimated line time spent polling
+            self.BusTime = 0
+            
+        def AddMeter(self,D111_ModBusAdd,PollInterval,Registers=D111_ALL_REGISTERS,Intervals=None):
+            
+            #Registers are polled every PollInterval seconds unless given their own interval in Intervals
+            if D111_ModBusAdd in self.Meters:
+                raise ValueError("Meter " + str(D111_ModBusAdd) + " is already on the bus")
+            
+            RegisterIntervals = dict.fromkeys(Registers,PollInterval)
+            RegisterIntervals.update(Intervals or {})
+            
+            #minimalmodbus shares one serial port object between instruments opened on the same port name
+            Meter = LovatoD111(D111_ModBusAdd,self.USB_SerialPortName,self.SerialTimeout)
+            Meter.Lovato_D111.serial.baudrate = self.Baudrate
+            
+            self.Meters[D111_ModBusAdd] = D111_BusMeter(Meter,RegisterIntervals)
+            self.PollOrder.append(D111_ModBusAdd)
+            
+            return Meter
+            
+        def RemoveMeter(self,D111_ModBusAdd):
+            
+            del self.Meters[D111_ModBusAdd]
+            self.PollOrder.remove(D111_ModBusAdd)
+            self.NextIndex = 0
+            
+        def Transaction(self,Function,*Args):
+            
+            #Run a single meter operation with exclusive use of the line
+            with self.BusLock:
+                return Function(*Args)
+            
+        def PlanPoll(self,BusMeter,Now):
+            
+            #Registers to read from a meter on this pass,None if nothing is due or the budget is spent
+            Due = BusMeter.DueRegisters(Now)
+            if not Due:
+                return None
+            
+            #Blocks holding the fastest registers go first when the budget cannot cover them all
+            Blocks = sorted(PlanBlockReads(Due),key=lambda Block: min(BusMeter.Intervals[Register] for Register in Block[2]))
+            
+            Registers = []
+            for Start,Count,BlockRegisters in Blocks:
+                
+                Cost = EstimateReadTime(Count,self.Baudrate)
+                if self.BusBudget is not None and min(Cost,self.BusBudget * MAX_BUDGET_BURST) > self.BudgetCredit:
+                    continue
+                
+                if self.BusBudget is not None:
+                    self.BudgetCredit -= Cost
+                self.BusTime += Cost
+                
+                #Registers that are not due yet but lie inside a block being read anyway come for free
+                Registers.extend(Register for Register in BusMeter.Intervals if Start <= Register < Start + Count)
+            
+            return tuple(sorted(set(Registers))) or None
+            
+        def PollDue(self):
+            
+            Now = time.monotonic()
+            Polled = {}
+            Count = len(self.PollOrder)
+            Start = self.NextIndex
+            
+            if self.BusBudget is not None:
+                self.BudgetCredit = min(self.BudgetCredit + (Now - self.BudgetUpdated) * self.BusBudget,self.BusBudget * MAX_BUDGET_BURST)
+                self.BudgetUpdated = Now
+            
+            #Visit every meter once,starting after the one polled last so that no meter is starved when the line is busy
+            for Offset in range(Count):
+                
+                Address = self.PollOrder[(Start + Offset) % Count]
+                BusMeter = self.Meters[Address]
+                
+                if BusMeter.BackoffUntil > Now:
+                    continue
+                
+                Registers = self.PlanPoll(BusMeter,Now)
+                if Registers is None:
+                    continue
+                
+                try:
+                    Reading = self.Transaction(BusMeter.Meter.ReadSnapshot,Registers)
+                    
+                except IOError as Error:
+                    #Meter did not respond or replied with a corrupt frame,skip it for longer on every consecutive failure
+                    BusMeter.Failures += 1
+                    BusMeter.LastError = Error
+                    BusMeter.BackoffUntil = time.monotonic() + min(MIN_BACKOFF * 2 ** (BusMeter.Failures - 1),MAX_BACKOFF)
+                    
+                    #The line sat idle for the whole timeout,charge it to the budget
+                    self.BusTime += self.SerialTimeout
+                    if self.BusBudget is not None:
+                        self.BudgetCredit -= self.SerialTimeout
+                    
+                else:
+                    BusMeter.Failures = 0
+                    BusMeter.LastError = None
+                    
+                    for Register in Registers:
+                        BusMeter.NextDue[Register] = Now + BusMeter.Intervals[Register]
+                    
+                    #Carry forward registers that were not read on this pass
+                    Values = {Register.name : getattr(Reading,Register.name) for Register in Registers}
+                    BusMeter.Reading = (BusMeter.Reading or D111_Snapshot())._replace(Timestamp=Reading.Timestamp,**Values)
+                    Polled[Address] = Reading
+                
+                self.NextIndex = (Start + Offset + 1) % Count
+            
+            #Readings of the meters polled during this pass keyed by Modbus address.Each holds only the registers read on this pass,
+            #the others are None,so every value carries the time it was actually read
+            return Polled
+            
+        def NextDue(self):
+            
+            #Seconds until the next meter is due,0 if one is already due
+            if not self.Meters:
+                return None
+            
+            return max(min(BusMeter.NextPoll() for BusMeter in self.Meters.values()) - time.monotonic(),0)
+            
+        def GetReading(self,D111_ModBusAdd):
+            
+            #Most recent value of every register of a meter,None until it has been read.Timestamp is that of the last successful poll
+            return self.Meters[D111_ModBusAdd].Reading
+            
+        def IsOnline(self,D111_ModBusAdd):
+            
+            return self.Meters[D111_ModBusAdd].Failures == 0
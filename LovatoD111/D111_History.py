@@ -0,0 +1,130 @@
+import math
+from   array import array
+from   .D111 import D111_ALL_REGISTERS
+
+#NumPy is only needed for vectorized aggregates,without it they are computed in pure Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#Aggregates computed over every measurement in a window
+D111_AGGREGATES = ('Min','Max','Mean','RMS','Last')
+
+def _Finite(Value):
+    
+    #NaN is not valid JSON,so a measurement missing from the latest sample is reported as None
+    return None if math.isnan(Value) else Value
+
+#Fixed-size history of D111 snapshots.Samples are stored row by row in a flat array of doubles so memory stays constant,
+#measurements that were missing from a snapshot are stored as NaN & left out of the aggregates
+class D111_History():
+
+        def __init__(self,Capacity,Registers=D111_ALL_REGISTERS):
+            
+            if Capacity < 1:
+                raise ValueError("History capacity must be at least 1")
+            
+            self.Capacity = Capacity
+            self.Fields = tuple(Register.name for Register in Registers)
+            
+            self.Samples = array('d',[math.nan]) * (Capacity * len(self.Fields))
+            self.Timestamps = array('d',[0.0]) * Capacity
+            
+            #Next row to be written & number of rows holding samples
+            self.Head = 0
+            self.Count = 0
+            
+        def __len__(self):
+            
+            return self.Count
+            
+        def Append(self,Snapshot):
+            
+            Row = self.Head * len(self.Fields)
+            
+            for Index,Field in enumerate(self.Fields):
+                Value = getattr(Snapshot,Field)
+                self.Samples[Row + Index] = math.nan if Value is None else float(Value)
+            
+            self.Timestamps[self.Head] = Snapshot.Timestamp
+            
+            #Overwrite the oldest sample once full
+            self.Head = (self.Head + 1) % self.Capacity
+            self.Count = min(self.Count + 1,self.Capacity)
+            
+        def Clear(self):
+            
+            self.Head = 0
+            self.Count = 0
+            
+        def Aggregate(self,Seconds=None,Now=None):
+            
+            #Min/max/mean/RMS & latest value of each measurement over the samples taken in the last Seconds (all samples if None),
+            #keyed by measurement name.Returns None when the window holds no samples
+            if self.Count == 0:
+                return None
+            
+            Newest = (self.Head - 1) % self.Capacity
+            Cutoff = -math.inf if Seconds is None else (self.Timestamps[Newest] if Now is None else Now) - Seconds
+            
+            if np is not None:
+                return self._AggregateArrays(Cutoff,Newest)
+            
+            return self._AggregateLists(Cutoff,Newest)
+            
+        def _AggregateArrays(self,Cutoff,Newest):
+            
+            #Zero-copy views over the stored rows
+            Samples = np.frombuffer(self.Samples,dtype=np.float64).reshape(self.Capacity,len(self.Fields))[:self.Count]
+            Timestamps = np.frombuffer(self.Timestamps,dtype=np.float64)[:self.Count]
+            
+            Window = Samples[Timestamps >= Cutoff]
+            if len(Window) == 0:
+                return None
+            
+            Valid = ~np.isnan(Window)
+            Counts = Valid.sum(axis=0)
+            Filled = np.where(Valid,Window,0.0)
+            
+            with np.errstate(invalid='ignore',divide='ignore'):
+                Columns = {
+                    'Min' : np.where(Valid,Window,np.inf).min(axis=0),
+                    'Max' : np.where(Valid,Window,-np.inf).max(axis=0),
+                    'Mean' : Filled.sum(axis=0) / Counts,
+                    'RMS' : np.sqrt((Filled * Filled).sum(axis=0) / Counts),
+                    'Last' : Samples[Newest],
+                }
+            
+            Result = {'Samples' : len(Window)}
+            for Index,Field in enumerate(self.Fields):
+                if Counts[Index] == 0:
+                    Result[Field] = None
+                else:
+                    Result[Field] = {Name : _Finite(float(Columns[Name][Index])) for Name in D111_AGGREGATES}
+            
+            return Result
+            
+        def _AggregateLists(self,Cutoff,Newest):
+            
+            Width = len(self.Fields)
+            Rows = [Row for Row in range(self.Count) if self.Timestamps[Row] >= Cutoff]
+            if not Rows:
+                return None
+            
+            Result = {'Samples' : len(Rows)}
+            for Index,Field in enumerate(self.Fields):
+                Values = [self.Samples[Row * Width + Index] for Row in Rows]
+                Values = [Value for Value in Values if not math.isnan(Value)]
+                if not Values:
+                    Result[Field] = None
+                    continue
+                Result[Field] = {
+                    'Min' : min(Values),
+                    'Max' : max(Values),
+                    'Mean' : sum(Values) / len(Values),
+                    'RMS' : math.sqrt(sum(Value * Value for Value in Values) / len(Values)),
+                    'Last' : _Finite(self.Samples[Newest * Width + Index]),
+                }
+            
+            return Result
@@ -0,0 +1,181 @@
+import socketserver
+import struct
+import threading
+import time
+from   .D111 import D111_RegisterMap, D111_StructFormats
+
+#Modbus TCP port,the standard port 502 needs root so the proxy defaults to the common unprivileged alternative
+D111_PROXY_PORT = 5020
+
+#Function codes served from the snapshot,holding & input registers map onto the same image
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+MAX_READ_REGISTERS = 125
+
+#Modbus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+GATEWAY_TARGET_FAILED = 0x0B
+
+#Smallest MBAP length field,the unit id plus a function code
+MIN_MBAP_LENGTH = 2
+
+#Freshness registers,placed above the meter's own address map:
+#  FRESHNESS_BASE + 0,1 : age of the snapshot in ms (0xFFFFFFFF before the first poll)
+#  FRESHNESS_BASE + 2,3 : unix time of the snapshot in seconds
+#  FRESHNESS_BASE + 4   : 1 if the snapshot is within MaxAge,else 0
+FRESHNESS_BASE = 0xF000
+FRESHNESS_REGISTERS = 5
+
+def EncodeSnapshot(Snapshot):
+    
+    #Register image of a snapshot,the inverse of the D111 decoders.Measurements that were not read are left out
+    Image = {}
+    
+    for Register,Spec in D111_RegisterMap.items():
+        
+        Value = getattr(Snapshot,Register.name)
+        if Value is None:
+            continue
+        
+        Raw = int(bool(Value)) if Spec.Unit is None else round(Value * Spec.Scale)
+        Words = struct.unpack('>' + 'H' * Spec.Width,struct.pack('>' + D111_StructFormats[(Spec.Width,Spec.Signed)],Raw))
+        
+        for Offset,Word in enumerate(Words):
+            Image[Register + Offset] = Word
+    
+    return Image
+
+class D111_ProxyHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            
+            while True:
+                
+                #MBAP header: transaction id,protocol id,length,unit id
+                Header = self.rfile.read(7)
+                if len(Header) < 7:
+                    return
+                
+                TransactionId,ProtocolId,Length,UnitId = struct.unpack('>HHHB',Header)
+                
+                #A length that cannot hold a function code means the stream is out of step,drop the connection
+                if Length < MIN_MBAP_LENGTH:
+                    return
+                
+                PDU = self.rfile.read(Length - 1)
+                if len(PDU) < Length - 1:
+                    return
+                
+                if ProtocolId != 0:
+                    continue
+                
+                Response = self.server.Proxy.HandlePDU(UnitId,PDU)
+                self.wfile.write(struct.pack('>HHHB',TransactionId,0,len(Response) + 1,UnitId) + Response)
+
+class D111_ProxyServer(socketserver.ThreadingTCPServer):
+
+        allow_reuse_address = True
+        daemon_threads = True
+
+#Modbus TCP server answering register reads from the latest polled snapshots,so local readers never touch the RS-485 line.
+#GetReading(UnitId) returns the latest snapshot of a meter,None if it has not been read yet,& raises KeyError for unknown meters
+class D111_Proxy():
+
+        def __init__(self,GetReading,Host='127.0.0.1',Port=D111_PROXY_PORT,MaxAge=None):
+            
+            self.GetReading = GetReading
+            self.Host = Host
+            self.Port = Port
+            self.MaxAge = MaxAge
+            
+            #Register image of the last snapshot served for each unit,rebuilt only when a new snapshot arrives
+            self.Images = {}
+            self.ImageLock = threading.Lock()
+            
+            self.Server = None
+            self.ServerThread = None
+            
+        def Start(self):
+            
+            self.Server = D111_ProxyServer((self.Host,self.Port),D111_ProxyHandler)
+            self.Server.Proxy = self
+            
+            #Port actually bound,useful when started on port 0
+            self.Port = self.Server.server_address[1]
+            
+            self.ServerThread = threading.Thread(target=self.Server.serve_forever,name="D111_Proxy",daemon=True)
+            self.ServerThread.start()
+            
+        def Stop(self):
+            
+            if self.Server is not None:
+                self.Server.shutdown()
+                self.Server.server_close()
+                self.Server = None
+            
+        def GetImage(self,UnitId):
+            
+            Snapshot = self.GetReading(UnitId)
+            if Snapshot is None:
+                return None,None
+            
+            with self.ImageLock:
+                Cached = self.Images.get(UnitId)
+                if Cached is None or Cached[0] is not Snapshot:
+                    Cached = self.Images[UnitId] = (Snapshot,EncodeSnapshot(Snapshot))
+            
+            return Cached
+            
+        def FreshnessWords(self,Snapshot):
+            
+            if Snapshot is None:
+                return (0xFFFF,0xFFFF,0,0,0)
+            
+            Age = max(time.time() - Snapshot.Timestamp,0)
+            Fresh = self.MaxAge is None or Age <= self.MaxAge
+            
+            return struct.unpack('>HHHHH',struct.pack('>IIH',min(int(Age * 1000),0xFFFFFFFE),int(Snapshot.Timestamp),int(Fresh)))
+            
+        def HandlePDU(self,UnitId,PDU):
+            
+            if len(PDU) < 1:
+                return bytes([0x80,ILLEGAL_FUNCTION])
+            
+            Function = PDU[0]
+            
+            if Function not in (READ_HOLDING_REGISTERS,READ_INPUT_REGISTERS):
+                return bytes([Function | 0x80,ILLEGAL_FUNCTION])
+            
+            if len(PDU) != 5:
+                return bytes([Function | 0x80,ILLEGAL_DATA_VALUE])
+            
+            Start,Count = struct.unpack('>HH',PDU[1:5])
+            
+            if Count < 1 or Count > MAX_READ_REGISTERS:
+                return bytes([Function | 0x80,ILLEGAL_DATA_VALUE])
+            
+            try:
+                Snapshot,Image = self.GetImage(UnitId)
+            except KeyError:
+                return bytes([Function | 0x80,GATEWAY_TARGET_FAILED])
+            
+            #Freshness metadata is always readable so clients can tell why data is unavailable
+            if Start >= FRESHNESS_BASE:
+                if Start + Count > FRESHNESS_BASE + FRESHNESS_REGISTERS:
+                    return bytes([Function | 0x80,ILLEGAL_DATA_ADDRESS])
+                Words = self.FreshnessWords(Snapshot)[Start - FRESHNESS_BASE:Start - FRESHNESS_BASE + Count]
+                
+            else:
+                if Start + Count > FRESHNESS_BASE:
+                    return bytes([Function | 0x80,ILLEGAL_DATA_ADDRESS])
+                
+                #No data yet,or data older than allowed
+                if Snapshot is None or (self.MaxAge is not None and time.time() - Snapshot.Timestamp > self.MaxAge):
+                    return bytes([Function | 0x80,GATEWAY_TARGET_FAILED])
+                
+                #Registers the meter does not report read as 0,as they would in a block read from the meter itself
+                Words = [Image.get(Address,0) for Address in range(Start,Start + Count)]
+            
+            return struct.pack('>BB' + 'H' * Count,Function,2 * Count,*Words)
@@ -0,0 +1,221 @@
+import argparse
+import math
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from   .D111 import D111_Snapshot, D111_DEFAULT_BAUDRATE
+from   .D111_Async import ModbusCRC, BITS_PER_CHAR, FIXED_FRAME_GAP, FIXED_FRAME_GAP_BAUDRATE, READ_HOLDING_REGISTERS, EXCEPTION_FLAG
+from   .D111_Proxy import EncodeSnapshot, MAX_READ_REGISTERS, ILLEGAL_FUNCTION, ILLEGAL_DATA_VALUE
+
+#Period of the synthetic voltage/current waveforms in seconds
+WAVE_PERIOD = 60
+
+#Active power above which the simulated programmable threshold alarm is raised,in kW
+ALARM_THRESHOLD = 1.5
+
+#Synthetic measurements of one simulated meter.Slaves are phase shifted so that every address reports different values
+def SimulatedSnapshot(Address,Elapsed):
+    
+    Phase = 2 * math.pi * Elapsed / WAVE_PERIOD + Address * 0.7
+    
+    Voltage = 230 + 4 * math.sin(Phase)
+    Current = 5 + 2 * math.sin(Phase * 3)
+    PwrFactor = 0.92 + 0.05 * math.sin(Phase / 2)
+    ActivePwr = Voltage * Current * PwrFactor / 1000
+    ReactivePwr = Voltage * Current * math.sin(math.acos(PwrFactor)) / 1000
+    
+    #Counters advance at the mean simulated power
+    Hours = Elapsed / 3600
+    Energy = 1000 + 100 * Address + 230 * 5 * 0.92 / 1000 * Hours
+    
+    return D111_Snapshot(
+        Voltage = Voltage,
+        Current = Current,
+        ActivePwr = ActivePwr,
+        ReactivePwr = ReactivePwr,
+        PwrFactor = PwrFactor,
+        Hz = 50 + 0.05 * math.sin(Phase * 5),
+        AvgKW_Pwr = 230 * 5 * 0.92 / 1000,
+        MaxAvgKW_Pwr = 234 * 7 * 0.97 / 1000,
+        TotActEnergy = Energy,
+        TotReactEnergy = Energy * 0.4,
+        PartialActEnergy = Energy - 1000,
+        PartialReactEnergy = (Energy - 1000) * 0.4,
+        HrCounter = 1000 + int(Hours),
+        PartialHrCounter = int(Hours),
+        ProgThresholdStatus = ActivePwr > ALARM_THRESHOLD,
+        Timestamp = time.time())
+
+#Simulated D111 meters answering Modbus RTU on a pseudo-terminal.Open SlavePort with LovatoD111,D111_Bus or AsyncLovatoD111.
+#Replies are paced at the configured baud rate & can be delayed,corrupted or dropped at the given rates
+class D111_Simulator():
+
+        def __init__(self,Addresses=(1,),Baudrate=D111_DEFAULT_BAUDRATE,Latency=0.0,Jitter=0.0,CRC_ErrorRate=0.0,DropRate=0.0,Seed=None):
+            
+            self.Addresses = set(Addresses)
+            self.Baudrate = Baudrate
+            self.Latency = Latency
+            self.Jitter = Jitter
+            self.CRC_ErrorRate = CRC_ErrorRate
+            self.DropRate = DropRate
+            
+            #Seeded so fault injection is repeatable between runs
+            self.Random = random.Random(Seed)
+            
+            self.CharTime = BITS_PER_CHAR / Baudrate
+            self.FrameGap = 3.5 * self.CharTime if Baudrate <= FIXED_FRAME_GAP_BAUDRATE else FIXED_FRAME_GAP
+            
+            self.Stats = {'Requests' : 0 , 'Responses' : 0 , 'Dropped' : 0 , 'Corrupted' : 0 , 'Ignored' : 0}
+            
+            self.MasterFd = None
+            self.SlaveFd = None
+            self.SlavePort = None
+            self.Running = False
+            self.Thread = None
+            self.StartTime = None
+            
+        def Start(self):
+            
+            self.MasterFd,self.SlaveFd = pty.openpty()
+            tty.setraw(self.MasterFd)
+            tty.setraw(self.SlaveFd)
+            self.SlavePort = os.ttyname(self.SlaveFd)
+            
+            self.StartTime = time.monotonic()
+            self.Running = True
+            self.Thread = threading.Thread(target=self.Serve,name="D111_Simulator",daemon=True)
+            self.Thread.start()
+            
+            return self.SlavePort
+            
+        def Stop(self):
+            
+            self.Running = False
+            if self.Thread is not None:
+                self.Thread.join()
+                self.Thread = None
+            
+            for Fd in (self.MasterFd,self.SlaveFd):
+                if Fd is not None:
+                    os.close(Fd)
+            self.MasterFd = self.SlaveFd = None
+            
+        def ReadFrame(self):
+            
+            #Wait for the first byte,then collect bytes until the line is silent for 3.5 characters
+            Frame = bytearray()
+            Timeout = 0.1
+            
+            while self.Running:
+                Readable,_,_ = select.select([self.MasterFd],[],[],Timeout)
+                if not Readable:
+                    if Frame:
+                        return bytes(Frame)
+                    continue
+                Frame += os.read(self.MasterFd,256)
+                Timeout = self.FrameGap
+            
+            return None
+            
+        def Serve(self):
+            
+            while self.Running:
+                
+                Request = self.ReadFrame()
+                if not Request:
+                    continue
+                
+                self.Stats['Requests'] += 1
+                
+                Response = self.HandleRequest(Request)
+                if Response is None:
+                    self.Stats['Ignored'] += 1
+                    continue
+                
+                if self.Random.random() < self.DropRate:
+                    self.Stats['Dropped'] += 1
+                    continue
+                
+                if self.Random.random() < self.CRC_ErrorRate:
+                    Response = Response[:-1] + bytes([Response[-1] ^ 0xFF])
+                    self.Stats['Corrupted'] += 1
+                
+                #Turnaround latency followed by the time the reply takes on the wire at the simulated baud rate
+                Delay = self.Latency + self.Random.uniform(0,self.Jitter) + len(Response) * self.CharTime
+                if Delay > 0:
+                    time.sleep(Delay)
+                
+                os.write(self.MasterFd,Response)
+                self.Stats['Responses'] += 1
+            
+        def HandleRequest(self,Request):
+            
+            #Frames with a bad CRC,for other slaves or broadcast (address 0) get no reply,as on a real bus
+            if len(Request) < 4 or ModbusCRC(Request) != 0:
+                return None
+            
+            Address,Function = Request[0],Request[1]
+            if Address not in self.Addresses:
+                return None
+            
+            if Function != READ_HOLDING_REGISTERS:
+                Response = bytearray([Address,Function | EXCEPTION_FLAG,ILLEGAL_FUNCTION])
+            
+            elif len(Request) != 8:
+                Response = bytearray([Address,Function | EXCEPTION_FLAG,ILLEGAL_DATA_VALUE])
+            
+            else:
+                Start,Count = struct.unpack('>HH',Request[2:6])
+                
+                if Count < 1 or Count > MAX_READ_REGISTERS:
+                    Response = bytearray([Address,Function | EXCEPTION_FLAG,ILLEGAL_DATA_VALUE])
+                else:
+                    Image = EncodeSnapshot(SimulatedSnapshot(Address,time.monotonic() - self.StartTime))
+                    Words = [Image.get(Register,0) for Register in range(Start,Start + Count)]
+                    Response = bytearray(struct.pack('>BBB' + 'H' * Count,Address,Function,2 * Count,*Words))
+            
+            Response += struct.pack('<H',ModbusCRC(Response))
+            
+            return bytes(Response)
+
+def ParseAddresses(Text):
+    
+    #"1-4,7" -> [1,2,3,4,7]
+    Addresses = []
+    for Part in Text.split(','):
+        if '-' in Part:
+            First,Last = Part.split('-')
+            Addresses.extend(range(int(First),int(Last) + 1))
+        else:
+            Addresses.append(int(Part))
+    return Addresses
+
+def main():
+    
+    Parser = argparse.ArgumentParser(description="Simulated Lovato D111 meters on a pseudo-terminal")
+    Parser.add_argument("--slaves",default="1",help="slave addresses, e.g. 1-8,12")
+    Parser.add_argument("--baud",type=int,default=D111_DEFAULT_BAUDRATE)
+    Parser.add_argument("--latency",type=float,default=0.0,help="turnaround latency in seconds")
+    Parser.add_argument("--jitter",type=float,default=0.0,help="extra random latency in seconds")
+    Parser.add_argument("--crc-error-rate",type=float,default=0.0)
+    Parser.add_argument("--drop-rate",type=float,default=0.0)
+    Parser.add_argument("--seed",type=int,default=None)
+    Args = Parser.parse_args()
+    
+    Simulator = D111_Simulator(ParseAddresses(Args.slaves),Args.baud,Args.latency,Args.jitter,Args.crc_error_rate,Args.drop_rate,Args.seed)
+    print("Simulated D111 meters on " + Simulator.Start())
+    
+    try:
+        while True:
+            time.sleep(10)
+            print(Simulator.Stats)
+    except KeyboardInterrupt:
+        Simulator.Stop()
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,6 @@
-from .D111 import LovatoD111
+from .D111 import LovatoD111, D111_Registers, D111_Snapshot, PlanBlockReads, D111_RegisterMap, DecodeBatch
+from .D111_Bus import D111_Bus
+from .D111_Async import AsyncLovatoD111, D111_AsyncPort, ReadSnapshots
+from .D111_History import D111_History
+from .D111_Proxy import D111_Proxy
+from .D111_Sim import D111_Simulator
@@ -0,0 +1,71 @@
+import time
+
+#Change a numeric field must exceed before it is reported again.Either bound may be given,a change beyond either one is reported
+class Deadband():
+
+        def __init__(self,Absolute=None,Percent=None):
+            
+            self.Absolute = Absolute
+            self.Percent = Percent
+            
+        def Exceeded(self,Last,Value):
+            
+            Change = abs(Value - Last)
+            
+            if self.Absolute is not None and Change > self.Absolute:
+                return True
+            
+            if self.Percent is not None and Change > abs(Last) * self.Percent / 100:
+                return True
+            
+            return False
+
+#Report-by-exception filter for a telemetry message.Numeric fields with a deadband are only reported once they move outside it,
+#every other field (alarms,states,levels) is reported as soon as it changes.The whole message is reported at least once per
+#KeepAlive seconds so the backend can tell a quiet device from a dead one
+class DeadbandFilter():
+
+        def __init__(self,Deadbands=None,KeepAlive=300):
+            
+            self.Deadbands = Deadbands or {}
+            self.KeepAlive = KeepAlive
+            self.Reset()
+            
+        def Reset(self):
+            
+            #Forget what was last reported,so the next message is reported in full (e.g. after a reconnection)
+            self.Reported = {}
+            self.LastKeepAlive = None
+            
+        def Changed(self,Field,Value):
+            
+            if Field not in self.Reported:
+                return True
+            
+            Last = self.Reported[Field]
+            Band = self.Deadbands.get(Field)
+            
+            #Deadbands only apply between two numbers,any other change is reported straight away
+            if Band is None or Value is None or Last is None or isinstance(Value,bool) or isinstance(Last,bool):
+                return Value != Last
+            
+            return Band.Exceeded(Last,Value)
+            
+        def Filter(self,Message,Now=None,Partial=False):
+            
+            #Returns the fields of Message that should be published now,an empty dict if nothing needs to be sent.
+            #A Partial message carries only some of the fields,so it never stands in for the full keep-alive report
+            Now = time.monotonic() if Now is None else Now
+            
+            KeepAliveDue = self.LastKeepAlive is None or Now - self.LastKeepAlive >= self.KeepAlive
+            
+            if KeepAliveDue and not Partial:
+                Report = dict(Message)
+                self.LastKeepAlive = Now
+            else:
+                Report = {Field : Value for Field,Value in Message.items() if self.Changed(Field,Value)}
+            
+            #Deadbands are measured from the last reported value so slow drift is still reported once it adds up
+            self.Reported.update(Report)
+            
+            return Report
@@ -0,0 +1 @@
+from .Deadband import Deadband, DeadbandFilter
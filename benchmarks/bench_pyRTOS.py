@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# pyRTOS benchmarks
+#
+# Stresses the schedulers, MessageQueue and Mutex with thousands of
+# synthetic tasks.  Everything runs tickless on a SimulatedClock, so
+# timeouts cost no real time and the numbers measure pyRTOS overhead only.
+# For each workload and scheduler it reports task switches (run_next()
+# calls) per second of real time, and it reports the memory one task
+# costs.  Run from the repository root:
+#
+#     python3 -m benchmarks.bench_pyRTOS [--tasks N] [--iterations N]
+import argparse
+import random
+import time
+import tracemalloc
+
+import pyRTOS
+
+
+SCHEDULERS = {
+	"default": lambda: None,
+	"priority": pyRTOS.PriorityScheduler,
+	"edf": pyRTOS.EDFScheduler,
+}
+
+
+# Each task sleeps for a random period, iterations times
+def timers_workload(task_count, iterations):
+	def sleeper(self):
+		period = random.uniform(0.001, 0.1)
+		yield
+		for i in range(iterations):
+			yield [pyRTOS.timeout(period)]
+
+	for i in range(task_count):
+		pyRTOS.add_task(pyRTOS.Task(sleeper, i % 32))
+
+
+# Producer/consumer pairs, each pair sharing a small MessageQueue
+def queue_workload(task_count, iterations):
+	def producer(queue):
+		def func(self):
+			yield
+			for i in range(iterations):
+				yield [queue.send(i)]
+		return func
+
+	def consumer(queue):
+		def func(self):
+			received = []
+			yield
+			while len(received) < iterations:
+				yield [queue.recv(received)]
+		return func
+
+	for i in range(task_count // 2):
+		queue = pyRTOS.MessageQueue(4)
+		pyRTOS.add_task(pyRTOS.Task(producer(queue), i % 32))
+		pyRTOS.add_task(pyRTOS.Task(consumer(queue), i % 32))
+
+
+# Every task contends for one Mutex, holding it across a short timeout
+def mutex_workload(task_count, iterations):
+	mutex = pyRTOS.Mutex()
+
+	def locker(self):
+		yield
+		for i in range(iterations):
+			yield [mutex.lock(self)]
+			yield [pyRTOS.timeout(0.0001)]
+			mutex.unlock()
+
+	for i in range(task_count):
+		pyRTOS.add_task(pyRTOS.Task(locker, i % 32))
+
+
+WORKLOADS = {
+	"timers": timers_workload,
+	"queue": queue_workload,
+	"mutex": mutex_workload,
+}
+
+
+def run(workload, scheduler, task_count, iterations):
+	pyRTOS.reset()
+	clock = pyRTOS.SimulatedClock()
+	pyRTOS.set_clock(clock)
+	random.seed(0)
+
+	WORKLOADS[workload](task_count, iterations)
+
+	switches = pyRTOS.Task._run_count
+	start = time.perf_counter()
+	pyRTOS.start(scheduler=SCHEDULERS[scheduler](), tickless=True)
+	elapsed = time.perf_counter() - start
+	switches = pyRTOS.Task._run_count - switches
+
+	return switches, elapsed, clock.monotonic()
+
+
+def memory_per_task(task_count):
+	pyRTOS.reset()
+	pyRTOS.set_clock(pyRTOS.SimulatedClock())
+
+	def idle(self):
+		yield
+		yield [pyRTOS.timeout(1)]
+
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	for i in range(task_count):
+		pyRTOS.add_task(pyRTOS.Task(idle, i % 32, name="task%d" % i, mailbox=True))
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+
+	pyRTOS.reset()
+	return (after - before) / task_count
+
+
+def main():
+	parser = argparse.ArgumentParser(description="pyRTOS scheduler benchmarks")
+	parser.add_argument("--tasks", type=int, default=1000)
+	parser.add_argument("--iterations", type=int, default=10)
+	parser.add_argument("--workload", choices=sorted(WORKLOADS), action="append")
+	parser.add_argument("--scheduler", choices=sorted(SCHEDULERS), action="append")
+	args = parser.parse_args()
+
+	print("%-8s %-9s %10s %10s %14s %12s" %
+		  ("workload", "scheduler", "switches", "seconds", "switches/sec", "sim seconds"))
+	for workload in args.workload or sorted(WORKLOADS):
+		for scheduler in args.scheduler or sorted(SCHEDULERS):
+			switches, elapsed, simulated = run(workload, scheduler, args.tasks, args.iterations)
+			print("%-8s %-9s %10d %10.3f %14.0f %12.3f" %
+				  (workload, scheduler, switches, elapsed, switches / elapsed, simulated))
+
+	print()
+	print("memory per task: %.0f bytes" % memory_per_task(args.tasks))
+
+	pyRTOS.set_clock(pyRTOS.MonotonicClock())
+
+
+if __name__ == "__main__":
+	main()
@@ -2,3 +2,5 @@ from pyRTOS.pyRTOS import *
 from pyRTOS.message import *
 from pyRTOS.task import *
 from pyRTOS.scheduler import *
+from pyRTOS.monitor import *
+from pyRTOS.aio import *
@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import threading
+
+import pyRTOS
+
+
+# asyncio backend
+#
+# Runs pyRTOS tasks on an asyncio event loop instead of pyRTOS.start(), so
+# they can share one loop with asyncio serial and network code.  Nothing
+# is polled that doesn't have to be:
+#
+#   - timeout()/timeout_ns() map to loop.call_at() on their deadline.
+#   - Event conditions (Mutex, MessageQueue, messages, notifications,
+#     futures) wake their task through Task.wake(), which may be called
+#     from any thread.
+#   - Other conditions (UFunctions, delay()) can't be predicted, so they
+#     are polled every poll_interval seconds while any are pending.
+#
+# Tasks run one step per loop callback, so I/O callbacks get to run in
+# between.  Tasks that become ready in the same loop iteration are queued
+# before the next step is picked, so the highest priority one runs first.
+# As with pyRTOS.start(), the running task keeps running until it blocks
+# or a strictly higher priority task becomes ready.
+class AsyncioScheduler(object):
+	def __init__(self, poll_interval=0.01, monitor=None):
+		self.poll_interval = poll_interval
+		self.monitor = monitor
+		self.loop = None
+		self.thread = None
+		self.tasks = None
+		self.ready = []        # Heap of (priority, seq, task)
+		self.queued = set()
+		self.blocked = {}      # BLOCKED task -> list of timer handles
+		self.polled = set()
+		self.poll_handle = None
+		self.dispatch_handle = None
+		self.running = None
+		self.seq = 0
+		self.finished = None
+
+	async def run(self, tasks):
+		self.loop = asyncio.get_running_loop()
+		self.thread = threading.get_ident()
+		self.tasks = tasks
+		self.finished = self.loop.create_future()
+		pyRTOS.Task._monitor = self.monitor
+
+		for task in tasks:
+			self._adopt(task)
+		self._schedule_dispatch()
+
+		try:
+			await self.finished
+		finally:
+			for task in tasks:
+				task._listener = None
+
+	# Adds a task while the scheduler is running
+	def add_task(self, task):
+		pyRTOS.add_task(task)
+		self._adopt(task)
+		self._schedule_dispatch()
+
+	def _adopt(self, task):
+		task._listener = self._changed
+		if task.state == pyRTOS.BLOCKED:
+			self._block(task)
+		elif task.state != pyRTOS.SUSPENDED:
+			task.state = pyRTOS.READY
+			self._push(task)
+
+	# Task listener.  Task.wake() and friends may be called from other
+	# threads, in which case the work is handed to the loop.
+	def _changed(self, task):
+		if threading.get_ident() == self.thread:
+			self._update(task)
+		else:
+			self.loop.call_soon_threadsafe(self._update, task)
+
+	def _update(self, task):
+		if task.state == pyRTOS.BLOCKED and task in self.blocked:
+			self._check(task)
+			return
+
+		self._discard(task)
+		if task is self.running and task.state != pyRTOS.RUNNING:
+			self.running = None
+
+		if task.state == pyRTOS.BLOCKED:
+			self._block(task)
+		elif task.state == pyRTOS.READY:
+			self._push(task)
+
+	def _block(self, task):
+		handles = []
+		self.blocked[task] = handles
+
+		for condition in task.ready_conditions:
+			if getattr(condition, "evented", False):
+				continue
+			deadline = getattr(condition, "deadline", None)
+			if deadline == None:
+				self.polled.add(task)
+				self._schedule_poll()
+			else:
+				self._arm(task, deadline)
+
+		# Conditions are first evaluated after the task blocks, which is
+		# also when event conditions register as waiters.
+		handles.append(self.loop.call_soon(self._check, task))
+
+	# Sets a loop timer for a deadline on the pyRTOS clock
+	def _arm(self, task, deadline):
+		when = self.loop.time() + (deadline - pyRTOS.get_clock().monotonic())
+		self.blocked[task].append(self.loop.call_at(when, self._expire, task, deadline))
+
+	# The loop's clock and the pyRTOS clock are read at different moments,
+	# so a timer can fire just before its deadline.  Re-arm it for what is
+	# left rather than leave the task blocked.
+	def _expire(self, task, deadline):
+		self._check(task)
+		if task in self.blocked:
+			if pyRTOS.get_clock().monotonic() < deadline:
+				self._arm(task, deadline)
+			elif task not in self.polled:
+				# Shouldn't happen, but never strand a task
+				self.polled.add(task)
+				self._schedule_poll()
+
+	def _check(self, task):
+		if task in self.blocked and self._conditions_met(task):
+			self._discard(task)
+			task.state = pyRTOS.READY
+			task._clear_conditions()
+			self._push(task)
+
+	def _conditions_met(self, task):
+		for condition in task.ready_conditions:
+			if next(condition):
+				return True
+		return False
+
+	def _poll(self):
+		self.poll_handle = None
+		for task in [t for t in self.polled if self._conditions_met(t)]:
+			self._discard(task)
+			task.state = pyRTOS.READY
+			task._clear_conditions()
+			self._push(task)
+		self._schedule_poll()
+
+	def _schedule_poll(self):
+		if self.polled and self.poll_handle == None:
+			self.poll_handle = self.loop.call_later(self.poll_interval, self._poll)
+
+	def _discard(self, task):
+		handles = self.blocked.pop(task, None)
+		if handles != None:
+			for handle in handles:
+				handle.cancel()
+		self.polled.discard(task)
+		# Ready heap entries are dropped lazily when popped
+		self.queued.discard(task)
+
+	def _push(self, task):
+		if task not in self.queued:
+			self.seq += 1
+			heapq.heappush(self.ready, (task.priority, self.seq, task))
+			self.queued.add(task)
+			self._schedule_dispatch()
+
+	def _pop(self):
+		while self.ready:
+			priority, seq, task = heapq.heappop(self.ready)
+			if task in self.queued and task.state == pyRTOS.READY:
+				self.queued.discard(task)
+				return task
+		return None
+
+	def _peek_priority(self):
+		while self.ready:
+			task = self.ready[0][2]
+			if task in self.queued and task.state == pyRTOS.READY:
+				return task.priority
+			heapq.heappop(self.ready)
+		return None
+
+	def _schedule_dispatch(self):
+		if self.dispatch_handle == None and self.loop != None:
+			self.dispatch_handle = self.loop.call_soon(self._dispatch)
+
+	# Runs one step of the highest priority ready task
+	def _dispatch(self):
+		self.dispatch_handle = None
+
+		for service in pyRTOS.service_routines:
+			service()
+
+		if self.monitor != None:
+			self.monitor.tick()
+
+		running = self.running
+		priority = self._peek_priority()
+		if priority != None and (running == None or priority < running.priority):
+			if running != None:
+				running.state = pyRTOS.READY
+				self._push(running)
+			running = self._pop()
+			running.state = pyRTOS.RUNNING
+			self.running = running
+
+		if running == None:
+			self._check_finished()
+			return
+
+		try:
+			messages = running.run_next()
+		except StopIteration:
+			self.running = None
+			running._listener = None
+			messages = running._out_messages
+			self.tasks.remove(running)
+			pyRTOS.remove_task(running)
+		except BaseException as e:
+			self.running = None
+			if not self.finished.done():
+				self.finished.set_exception(e)
+			return
+		else:
+			if running.state != pyRTOS.RUNNING:
+				self.running = None
+				if running.state == pyRTOS.BLOCKED:
+					self._block(running)
+				elif running.state == pyRTOS.READY:
+					self._push(running)
+
+		pyRTOS.deliver_messages(messages, self.tasks)
+
+		if self.running != None or self.queued:
+			self._schedule_dispatch()
+		else:
+			self._check_finished()
+
+	def _check_finished(self):
+		if len(self.tasks) == 0 and not self.finished.done():
+			self.finished.set_result(None)
+
+
+# Run the tasks added with pyRTOS.add_task() on the current asyncio event
+# loop.  This is a coroutine that returns once every task has finished,
+# so it can be run with asyncio.run() or alongside other coroutines.
+async def run_async(poll_interval=0.01, monitor=None):
+	await AsyncioScheduler(poll_interval, monitor).run(pyRTOS.tasks)
@@ -1,3 +1,5 @@
+import collections
+
 import pyRTOS
 
 # Message Types
@@ -5,8 +7,24 @@ QUIT = 0
 # 1-127 are reserved for future use
 # 128+ may be used for user defined message types
 
+# Target for messages that go to every task with a mailbox except the
+# sender
+class _Broadcast(object):
+	def __repr__(self):
+		return "BROADCAST"
+
+BROADCAST = _Broadcast()
+
+# Delivery counters.  Messages to unknown names or groups, or to tasks
+# without a mailbox, are counted as undeliverable instead of vanishing,
+# and undeliverable_targets records who they were addressed to.
+message_stats = {"delivered": 0, "undeliverable": 0,
+				 "undeliverable_targets": collections.Counter()}
+
 
 class Message(object):
+	__slots__ = ("type", "source", "target", "message")
+
 	def __init__(self, type, source, target, message=None):
 		self.type = type
 		self.source = source
@@ -14,62 +32,203 @@ class Message(object):
 		self.message = message
 
 
+# A message target can be a Task, a task name, a group name (see
+# pyRTOS.join_group()) or BROADCAST.  Names are resolved through
+# pyRTOS.task_names, so routing doesn't depend on the number of tasks.
 def deliver_messages(messages, tasks):
 	for message in messages:
-		if type(message.target) == pyRTOS.Task:
-			message.target.deliver(message)
+		target = message.target
+		if isinstance(target, pyRTOS.Task):
+			_deliver(message, target)
+		elif target is BROADCAST:
+			_multicast(message, tasks)
+		elif target in pyRTOS.task_names:
+			_deliver(message, pyRTOS.task_names[target])
+		elif target in pyRTOS.task_groups:
+			_multicast(message, pyRTOS.task_groups[target])
+		elif tasks is not pyRTOS.tasks:
+			# Task lists that weren't built with add_task() aren't in the
+			# registry, so fall back to searching them
+			for task in tasks:
+				if task.name == target:
+					_deliver(message, task)
+					break
+			else:
+				_undeliverable(message)
 		else:
-			targets = filter(lambda t: message.target == t.name, tasks)
-			try:
-				next(targets).deliver(message)
-			except StopIteration:
-				pass
+			_undeliverable(message)
+
+
+def _deliver(message, task):
+	if task.mailbox:
+		task.deliver(message)
+		message_stats["delivered"] += 1
+	else:
+		_undeliverable(message)
+
+def _multicast(message, tasks):
+	for task in tasks:
+		if task.mailbox and task is not message.source:
+			task.deliver(message)
+			message_stats["delivered"] += 1
+
+def _undeliverable(message):
+	message_stats["undeliverable"] += 1
+	target = message.target
+	if isinstance(target, pyRTOS.Task):
+		target = target.name
+	message_stats["undeliverable_targets"][target] += 1
 
 
+# Bounded FIFO of messages between tasks.  The buffer is a deque, so both
+# ends are O(1), and the batched calls move as many messages as they can
+# per wakeup instead of one.
 class MessageQueue(object):
 	def __init__(self, capacity=10):
 		self.capacity = capacity
-		self.buffer = []
-
-	# This is a blocking condition
-	def send(self, msg):
-		sent = False
-
-		while True:
-			if sent:
-				yield True
-			elif len(self.buffer) < self.capacity:
-				self.buffer.append(msg)
-				yield True
-			else:
-				yield False
+		self.buffer = collections.deque()
+		self.senders = collections.deque()    # QueueSend waiters
+		self.receivers = collections.deque()  # QueueRecv waiters
+
+	# This is a blocking condition.  task defaults to the task that is
+	# currently running, which is who gets woken when space frees up.
+	def send(self, msg, task=None):
+		return QueueSend(self, (msg,), task)
+
+	# This is a blocking condition.  It stays blocked until every message
+	# in msgs has been queued, queueing as many as fit each time it is
+	# checked.
+	def send_many(self, msgs, task=None):
+		return QueueSend(self, msgs, task)
 
 	def nb_send(self, msg):
 		if len(self.buffer) < self.capacity:
 			self.buffer.append(msg)
+			pyRTOS.EventCondition.wake_first(self.receivers)
 			return True
 		else:
 			return False
 
+	# Queues as many of msgs as fit and returns how many that was
+	def nb_send_many(self, msgs):
+		count = min(len(msgs), self.capacity - len(self.buffer))
+		if count > 0:
+			self.buffer.extend(msgs[:count] if count < len(msgs) else msgs)
+			self._wake(self.receivers, count)
+		return max(count, 0)
+
 
 	# This is a blocking condition.
 	# out_buffer should be a list
-	def recv(self, out_buffer):
-		received = False
-		while True:
-			if received:
-				yield True
-			elif len(self.buffer) > 0:
-				received = True
-				out_buffer.append(self.buffer.pop(0))
-				yield True
-			else:
-				yield False
+	def recv(self, out_buffer, task=None):
+		return QueueRecv(self, out_buffer, 1, task)
+
+	# This is a blocking condition.  Once at least one message is
+	# available, moves up to max_n messages into out_buffer.
+	def recv_many(self, out_buffer, max_n, task=None):
+		return QueueRecv(self, out_buffer, max_n, task)
 
 	
 	def nb_recv(self):
 		if len(self.buffer) > 0:
-			return self.buffer.pop(0)
+			msg = self.buffer.popleft()
+			pyRTOS.EventCondition.wake_first(self.senders)
+			return msg
 		else:
 			return None
 
+	# Returns a list of up to max_n messages, which may be empty
+	def nb_recv_many(self, max_n):
+		out_buffer = []
+		self._drain(out_buffer, max_n)
+		return out_buffer
+
+	def _drain(self, out_buffer, max_n):
+		buffer = self.buffer
+		count = min(len(buffer), max_n)
+		if count == len(buffer):
+			out_buffer.extend(buffer)
+			buffer.clear()
+		else:
+			popleft = buffer.popleft
+			for i in range(count):
+				out_buffer.append(popleft())
+
+		if count > 0:
+			self._wake(self.senders, count)
+		return count
+
+	@staticmethod
+	def _wake(waiters, count):
+		for i in range(min(count, len(waiters))):
+			waiters.popleft()._wake()
+
+
+class QueueSend(pyRTOS.EventCondition):
+	def __init__(self, queue, msgs, task=None):
+		if task == None:
+			task = pyRTOS.Task.current
+		pyRTOS.EventCondition.__init__(self, task)
+		self.message_queue = queue
+		self.msgs = msgs
+		self.sent = 0
+
+	def __next__(self):
+		if self.done:
+			return True
+
+		queue = self.message_queue
+		space = queue.capacity - len(queue.buffer)
+		if space > 0:
+			msgs = self.msgs
+			count = min(space, len(msgs) - self.sent)
+			if self.sent == 0 and count == len(msgs):
+				queue.buffer.extend(msgs)
+			else:
+				for i in range(self.sent, self.sent + count):
+					queue.buffer.append(msgs[i])
+			self.sent += count
+			queue._wake(queue.receivers, count)
+
+			if self.sent == len(msgs):
+				self.done = True
+				self.close()
+				return True
+
+		self._wait(queue.senders)
+		return False
+
+	def _pass_on(self):
+		queue = self.message_queue
+		if len(queue.buffer) < queue.capacity:
+			pyRTOS.EventCondition.wake_first(queue.senders)
+
+
+class QueueRecv(pyRTOS.EventCondition):
+	def __init__(self, queue, out_buffer, max_n=1, task=None):
+		if task == None:
+			task = pyRTOS.Task.current
+		pyRTOS.EventCondition.__init__(self, task)
+		self.message_queue = queue
+		self.out_buffer = out_buffer
+		self.max_n = max_n
+
+	def __next__(self):
+		if self.done:
+			return True
+
+		queue = self.message_queue
+		if len(queue.buffer) > 0:
+			queue._drain(self.out_buffer, self.max_n)
+			self.done = True
+			self.close()
+			return True
+
+		self._wait(queue.receivers)
+		return False
+
+	def _pass_on(self):
+		queue = self.message_queue
+		if len(queue.buffer) > 0:
+			pyRTOS.EventCondition.wake_first(queue.receivers)
+
@@ -0,0 +1,131 @@
+import bisect
+import time
+
+import pyRTOS
+
+
+# Upper bounds, in seconds, of the wakeup lateness histogram buckets.  The
+# last bucket counts everything later than the final bound.
+LATENESS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class TaskStats(object):
+	__slots__ = ("runs", "cpu_time", "run_time", "max_run_time",
+				 "wakeups", "late_wakeups", "max_lateness",
+				 "lateness_histogram", "deadline")
+
+	def __init__(self):
+		self.runs = 0
+		self.cpu_time = 0.0
+		self.run_time = 0.0
+		self.max_run_time = 0.0
+		self.wakeups = 0        # Wakeups after a timeout had expired
+		self.late_wakeups = 0   # Wakeups later than the miss threshold
+		self.max_lateness = 0.0
+		self.lateness_histogram = [0] * (len(LATENESS_BUCKETS) + 1)
+		self.deadline = None    # Earliest deadline the task is blocked on
+
+
+# Scheduler instrumentation
+#
+# Pass an instance to pyRTOS.start(monitor=...) or pyRTOS.run_async() to
+# record, per task, how many times it ran, the CPU time and wall time its
+# steps took, and how late it woke after the earliest timeout it was
+# blocked on expired.  Wakeups later than miss_threshold seconds count as
+# deadline misses.  The loop's pass rate and, in tickless mode, the time
+# spent asleep are recorded too.
+#
+# Recording costs a few clock reads per task step, and nothing at all
+# when no monitor is installed.  snapshot() returns plain dicts and
+# numbers, ready to be published with json.dumps().
+class SchedulerMonitor(object):
+	def __init__(self, miss_threshold=0.05):
+		self.miss_threshold = miss_threshold
+		self.reset()
+
+	def reset(self):
+		self.stats = {}
+		self.ticks = 0
+		self.idle_time = 0.0
+		self.started = pyRTOS.get_clock().monotonic()
+		self.last_snapshot = (self.started, 0, 0.0)
+
+	def _task_stats(self, task):
+		stats = self.stats.get(task)
+		if stats == None:
+			stats = self.stats[task] = TaskStats()
+		return stats
+
+	# Called by Task.run_next() before stepping the task.  Returns the
+	# start times for task_stopped().
+	def task_started(self, task):
+		now = pyRTOS.get_clock().monotonic()
+		stats = self._task_stats(task)
+
+		if stats.deadline != None:
+			lateness = now - stats.deadline
+			stats.deadline = None
+			if lateness >= 0:
+				stats.wakeups += 1
+				stats.lateness_histogram[bisect.bisect_left(LATENESS_BUCKETS, lateness)] += 1
+				if lateness > stats.max_lateness:
+					stats.max_lateness = lateness
+				if lateness > self.miss_threshold:
+					stats.late_wakeups += 1
+
+		return (time.perf_counter(), time.thread_time())
+
+	def task_stopped(self, task, started):
+		run_time = time.perf_counter() - started[0]
+		stats = self.stats[task]
+		stats.runs += 1
+		stats.cpu_time += time.thread_time() - started[1]
+		stats.run_time += run_time
+		if run_time > stats.max_run_time:
+			stats.max_run_time = run_time
+
+	def task_blocked(self, task, conditions):
+		deadline = None
+		for condition in conditions:
+			condition_deadline = getattr(condition, "deadline", None)
+			if condition_deadline != None and \
+			   (deadline == None or condition_deadline < deadline):
+				deadline = condition_deadline
+		self._task_stats(task).deadline = deadline
+
+	def tick(self):
+		self.ticks += 1
+
+	def idle(self, seconds):
+		self.idle_time += seconds
+
+	def snapshot(self):
+		now = pyRTOS.get_clock().monotonic()
+		last_time, last_ticks, last_idle = self.last_snapshot
+		elapsed = now - last_time
+		self.last_snapshot = (now, self.ticks, self.idle_time)
+
+		tasks = {}
+		for task, stats in self.stats.items():
+			entry = tasks[task.name if task.name != None else repr(task)] = {
+				"runs": stats.runs,
+				"cpu_time": stats.cpu_time,
+				"run_time": stats.run_time,
+				"max_run_time": stats.max_run_time,
+				"wakeups": stats.wakeups,
+				"late_wakeups": stats.late_wakeups,
+				"max_lateness": stats.max_lateness,
+				"lateness_histogram": list(stats.lateness_histogram),
+			}
+			if isinstance(task, pyRTOS.PeriodicTask):
+				entry["jobs"] = task.jobs
+				entry["overruns"] = task.overruns
+				entry["skipped"] = task.skipped
+
+		return {
+			"uptime": now - self.started,
+			"ticks": self.ticks,
+			"tick_rate": (self.ticks - last_ticks) / elapsed if elapsed > 0 else 0.0,
+			"idle_fraction": (self.idle_time - last_idle) / elapsed if elapsed > 0 else 0.0,
+			"tasks": tasks,
+		}
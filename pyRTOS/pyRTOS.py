@@ -1,3 +1,8 @@
+import collections
+import concurrent.futures
+import heapq
+import math
+import threading
 import time
 
 import pyRTOS
@@ -8,77 +13,466 @@ version = 0.1
 tasks = []
 service_routines = []
 
+# Message routing.  task_names maps names to tasks so that messages
+# addressed by name don't need a search, and task_groups maps group
+# names to their member tasks.  Both are kept up to date by add_task(),
+# remove_task(), join_group() and leave_group().  When several tasks
+# share a name, messages to it go to the highest priority one, the first
+# added among equals, which is the task a search of the task list finds.
+task_names = {}
+task_groups = {}
+
+# Clocks
+#
+# All pyRTOS timing (timeouts, periodic releases, tickless sleeps, the
+# schedulers' timers) goes through the current clock, which set_clock()
+# replaces.  A clock provides monotonic() and monotonic_ns(), with the
+# same meaning as the time module functions, and wait(event, seconds),
+# which sleeps until the threading.Event is set or the time has passed.
+class MonotonicClock(object):
+	def monotonic(self):
+		return time.monotonic()
+
+	def monotonic_ns(self):
+		return time.monotonic_ns()
+
+	def wait(self, event, seconds=None):
+		event.wait(seconds)
+
+
+# Virtual clock for simulation and benchmarking.  Time only moves when
+# advance() is called or when the tickless loop waits, which jumps
+# straight to the deadline it is waiting for.  Use it with
+# start(tickless=True).
+class SimulatedClock(object):
+	def __init__(self, start=0.0):
+		self.now_ns = int(start * 1000000000)
+
+	def monotonic(self):
+		return self.now_ns / 1e9
+
+	def monotonic_ns(self):
+		return self.now_ns
+
+	def advance(self, seconds):
+		# Rounded up so that advancing to a deadline always reaches it
+		self.now_ns += math.ceil(seconds * 1000000000)
+
+	def wait(self, event, seconds=None):
+		if event.is_set():
+			return
+		if seconds == None:
+			raise RuntimeError("SimulatedClock: every task is waiting on something that can never happen")
+		self.advance(seconds)
+
+
+_clock = MonotonicClock()
+
+def set_clock(clock):
+	global _clock
+	_clock = clock
+
+def get_clock():
+	return _clock
+
+
+# Tickless idle.  While start(tickless=True) is running, timeouts push
+# their absolute deadlines onto this heap so that, when a pass of the
+# scheduler runs no task, start() can sleep until the earliest deadline
+# instead of spinning.  Entries are never removed when a timeout is
+# abandoned; the loop drops the ones that have passed after every pass,
+# so stale ones cause at most a single spurious wakeup.
+_tickless = False
+_stay_awake = False  # Set during a pass by delay() to keep the loop awake
+_deadlines = []
+_wakeup_event = threading.Event()
+
+# Thread pool behind run_in_executor(), created on first use
+_executor = None
+
 
 def add_task(task):
 	if task.thread == None:
 		task.initialize()
 
-	tasks.append(task) 
+	# Binary search for the insertion point, after any tasks of equal
+	# priority, rather than re-sorting the whole list.
+	low = 0
+	high = len(tasks)
+	while low < high:
+		mid = (low + high) // 2
+		if tasks[mid].priority <= task.priority:
+			low = mid + 1
+		else:
+			high = mid
+
+	tasks.insert(low, task)
+	pyRTOS.Task._add_count += 1
+
+	if task.name != None:
+		named = task_names.get(task.name)
+		if named == None or task.priority < named.priority:
+			task_names[task.name] = task
+
+
+# Removes a task from the task list and from message routing.  Schedulers
+# call this when a task's function returns.
+def remove_task(task):
+	if task in tasks:
+		tasks.remove(task)
+
+	if task.name != None and task_names.get(task.name) is task:
+		del task_names[task.name]
+		# Hand the name to the highest priority task left that has it
+		for other in tasks:
+			if other.name == task.name:
+				task_names[task.name] = other
+				break
+
+	for group in list(task_groups):
+		leave_group(task, group)
 
-	tasks.sort(key=lambda t: t.priority)
+
+# Task groups are named sets of tasks that a message can be multicast to
+# by using the group name as its target.
+def join_group(task, group):
+	members = task_groups.setdefault(group, [])
+	if task not in members:
+		members.append(task)
+
+def leave_group(task, group):
+	members = task_groups.get(group)
+	if members != None and task in members:
+		members.remove(task)
+		if not members:
+			del task_groups[group]
 
 
 def add_service_routine(service_routine):
 	service_routines.append(service_routine)
 
 
-def start(scheduler=None):
-	global tasks
+# Forgets every task, service routine, pending deadline and message
+# count, for tests and benchmarks that run pyRTOS more than once in the
+# same process.
+def reset():
+	del tasks[:]
+	del service_routines[:]
+	task_names.clear()
+	task_groups.clear()
+	stats = pyRTOS.message_stats
+	stats["delivered"] = 0
+	stats["undeliverable"] = 0
+	stats["undeliverable_targets"].clear()
+	del _deadlines[:]
+	_wakeup_event.clear()
+
+
+# Wake the main loop from a tickless sleep.  This is safe to call from
+# other threads (MQTT callbacks, serial readers, etc.) and should be
+# called whenever something outside of pyRTOS changes state that a
+# blocked task is waiting on.
+def wakeup():
+	_wakeup_event.set()
+
+
+def _add_deadline(deadline):
+	if _tickless:
+		heapq.heappush(_deadlines, deadline)
+
+# Deadlines at or before pass_start were already visible to the pass that
+# just ran, so any task waiting on them has been made ready and they can
+# be dropped.
+def _prune_deadlines(pass_start):
+	while _deadlines and _deadlines[0] <= pass_start:
+		heapq.heappop(_deadlines)
+
+# Sleep until the earliest pending deadline or until wakeup() is called.
+# Returns the time spent asleep.
+def _idle():
+	idle_start = _clock.monotonic()
+	if _deadlines:
+		wait = _deadlines[0] - idle_start
+		if wait > 0:
+			_clock.wait(_wakeup_event, wait)
+	else:
+		_clock.wait(_wakeup_event)
+
+	_wakeup_event.clear()
+	return _clock.monotonic() - idle_start
+
+
+# In tickless mode the loop sleeps whenever a pass runs no task.  Service
+# routines then only run when the loop wakes, so anything they poll must
+# either be covered by a timeout or call wakeup().
+#
+# monitor is an optional pyRTOS.SchedulerMonitor that records per task
+# timings and the pass rate.
+def start(scheduler=None, tickless=False, monitor=None):
+	global tasks, _tickless, _stay_awake
 
 	if scheduler == None:
 		scheduler = pyRTOS.default_scheduler
 
-	run = True
-	while run:
-		for service in service_routines:
-			service()
+	pyRTOS.Task._monitor = monitor
+
+	_tickless = tickless
+	try:
+		run = True
+		while run:
+			for service in service_routines:
+				service()
 
-		messages = scheduler(tasks)
-		pyRTOS.deliver_messages(messages, tasks)
+			pass_start = _clock.monotonic()
+			run_count = pyRTOS.Task._run_count
+			_stay_awake = False
 
-		if len(tasks) == 0:
-			run = False
+			messages = scheduler(tasks)
+			pyRTOS.deliver_messages(messages, tasks)
+
+			if monitor != None:
+				monitor.tick()
+
+			if tickless:
+				_prune_deadlines(pass_start)
+
+			if len(tasks) == 0:
+				run = False
+			elif tickless and pyRTOS.Task._run_count == run_count and \
+			     not _stay_awake:
+				slept = _idle()
+				if monitor != None:
+					monitor.idle(slept)
+	finally:
+		_tickless = False
+		del _deadlines[:]
 
 
 
 # Task Block Conditions
 
 # Timeout   - Task is delayed for no less than the specified time.
-def timeout(seconds):
-		start = time.monotonic()
+#             These are iterators rather than generators so that the
+#             absolute deadline is visible to the scheduler and to the
+#             tickless idle loop.
+class Timeout(object):
+	def __init__(self, seconds=0, deadline=None):
+		if deadline == None:
+			deadline = _clock.monotonic() + seconds
 
-		while True:
-			yield time.monotonic() - start >= seconds
+		self.deadline = deadline
+		_add_deadline(deadline)
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		return _clock.monotonic() >= self.deadline
+
+
+class TimeoutNs(object):
+	def __init__(self, nanoseconds):
+		self.deadline_ns = _clock.monotonic_ns() + nanoseconds
+		# Rounded up a microsecond so that waking at the float deadline
+		# never lands just short of the integer one.
+		self.deadline = self.deadline_ns / 1e9 + 1e-6
+		_add_deadline(self.deadline)
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		return _clock.monotonic_ns() >= self.deadline_ns
+
+
+def timeout(seconds):
+	return Timeout(seconds)
 
 def timeout_ns(nanoseconds):
-		start = time.monotonic_ns()
+	return TimeoutNs(nanoseconds)
 
-		while True:
-			yield time.monotonic_ns() - start >= nanoseconds
+# Absolute Timeout - Task is delayed until the clock reaches
+#                    deadline.  Used for drift free periodic releases.
+def timeout_until(deadline):
+	return Timeout(deadline=deadline)
 
 # Cycle Delay - Task is delayed for no less than the number OS loops specified.
+#               While counting down it keeps the tickless loop from
+#               sleeping, since the passes it counts don't move the clock.
 def delay(cycles):
+	global _stay_awake
 	ttl = cycles
 	while True:
 		if ttl > 0:
 			ttl -= 1
+			_stay_awake = True
 			yield False
 		else:
 			yield True
 
 # Message   - Task is waiting for a message.
 def wait_for_message(self):
-	while True:
-		yield self.message_count() > 0
+	return MessageWait(self)
 
 # Notification - Task is waiting for a notification
 def wait_for_notification(task, index=0, state=1):
-	task.notes[0][index] = 0
-	while task.notes[0][index] != state:
-		yield False
+	return NotificationWait(task, index, state)
 
-	while True:
-		yield True
+
+# Event Conditions
+#
+# These are block conditions that are satisfied by something happening
+# rather than by time passing.  Whatever makes them true (unlock(),
+# nb_send(), deliver(), notify_set_value(), ...) calls task.wake() on
+# exactly the tasks registered as waiting, so a scheduler that understands
+# the "evented" flag (PriorityScheduler) never has to poll them.  They
+# still answer next() correctly, so default_scheduler and custom ANDed
+# UFunctions keep working.
+#
+# A condition registers itself as a waiter the first time it is checked
+# and finds it cannot proceed.  If the task unblocks on some other
+# condition first, the scheduler calls close(), which withdraws it.  A
+# condition that was woken but then abandoned passes the wakeup on, so
+# the event is never lost.
+class EventCondition(object):
+	evented = True
+
+	def __init__(self, task):
+		self.task = task
+		self.queue = None  # The wait list this condition is registered in
+		self.woken = False
+		self.done = False
+
+		# Without a task there is nobody to wake, so it has to be polled
+		if task == None:
+			self.evented = False
+
+	def __iter__(self):
+		return self
+
+	# Wake the first waiter in a FIFO wait list
+	@staticmethod
+	def wake_first(queue):
+		if queue:
+			queue.popleft()._wake()
+
+	def _wait(self, queue):
+		if self.queue == None:
+			self.queue = queue
+			queue.append(self)
+		self.woken = False
+
+	def _wake(self):
+		self.queue = None
+		self.woken = True
+		if self.task != None:
+			self.task.wake()
+
+	# Pass an unused wakeup on to the next waiter.  Overridden by
+	# conditions whose owner has more waiters.
+	def _pass_on(self):
+		pass
+
+	def close(self):
+		if self.queue != None:
+			self.queue.remove(self)
+			self.queue = None
+		elif self.woken and not self.done:
+			self.woken = False
+			self._pass_on()
+
+
+
+class MessageWait(EventCondition):
+	def __next__(self):
+		if self.task.message_count() > 0:
+			self.done = True
+			return True
+
+		if self.task._message_waiter == None:
+			self.task._message_waiter = self
+		self.woken = False
+		return False
+
+	def close(self):
+		if self.task._message_waiter is self:
+			self.task._message_waiter = None
+
+
+class NotificationWait(EventCondition):
+	def __init__(self, task, index=0, state=1):
+		EventCondition.__init__(self, task)
+		self.index = index
+		self.state = state
+		task.notes[0][index] = 0
+
+	def __next__(self):
+		if not self.done:
+			if self.task.notes[0][self.index] != self.state:
+				self._wait(self.task._note_waiters)
+				return False
+			self.done = True
+		return True
+
+	def close(self):
+		if self.queue != None:
+			self.queue.remove(self)
+			self.queue = None
+
+
+
+# Future    - Task is waiting for a future to complete.  Works with both
+#             concurrent.futures and asyncio futures, whose done callbacks
+#             wake the task from whatever thread completes them.
+class FutureWait(EventCondition):
+	def __init__(self, future, task=None):
+		if task == None:
+			task = pyRTOS.Task.current
+		EventCondition.__init__(self, task)
+		self.future = future
+		future.add_done_callback(self._future_done)
+
+	def _future_done(self, future):
+		if self.task != None:
+			self.task.wake()
+
+	def __next__(self):
+		if self.future.done():
+			self.done = True
+			return True
+		return False
+
+	# Returns the future's result, raising its exception if it failed
+	def result(self):
+		return self.future.result()
+
+	# The done callback can't be withdrawn from every kind of future; a
+	# late one just makes the scheduler re-check the task.
+	def close(self):
+		pass
+
+def wait_for_future(future, task=None):
+	return FutureWait(future, task)
+
+# Executor  - Task is waiting for a blocking call (serial, Modbus, network)
+#             that runs on a worker thread, so the rest of the tasks keep
+#             running meanwhile.  Use it like
+#
+#                 call = pyRTOS.run_in_executor(meter.GetVoltage)
+#                 yield [call]
+#                 voltage = call.result()
+def run_in_executor(fn, *args):
+	global _executor
+	if _executor == None:
+		_executor = concurrent.futures.ThreadPoolExecutor(
+			max_workers=4, thread_name_prefix="pyRTOS")
+
+	return FutureWait(_executor.submit(fn, *args))
+
+# Replaces the worker pool used by run_in_executor()
+def set_executor(executor):
+	global _executor
+	_executor = executor
 
 
 
@@ -121,17 +515,14 @@ def wait_for_notification(task, index=0, state=1):
 class Mutex(object):
 	def __init__(self):
 		self.locked = False
+		self.waiters = []  # Heap of (priority, seq, MutexLock)
+		self.seq = 0
 
-	# This returns a task block condition generator.  It should
-	# only be called using something like "yield [mutex.lock(self)]"
+	# This returns a task block condition.  It should only be
+	# called using something like "yield [mutex.lock(self)]"
 	# or "yield [mutex.lock(self), timeout(1)]"
 	def lock(self, task):
-		while True:
-			if self.locked == False or self.locked == task:
-				self.locked = task
-				yield True
-			else:
-				yield False
+		return MutexLock(self, task)
 
 	def nb_lock(self, task):
 		if self.locked == False or self.locked == task:
@@ -140,37 +531,59 @@ class Mutex(object):
 		else:
 			return False
 
+	# Wakes only the highest priority waiter
 	def unlock(self):
 		self.locked = False
+		if self.waiters:
+			heapq.heappop(self.waiters)[2]._wake()
+
+
+class MutexLock(EventCondition):
+	def __init__(self, mutex, task):
+		EventCondition.__init__(self, task)
+		self.mutex = mutex
+
+	def __next__(self):
+		mutex = self.mutex
+		if mutex.locked == False or mutex.locked == self.task:
+			mutex.locked = self.task
+			self.done = True
+			self.close()
+			return True
+
+		if self.queue == None:
+			mutex.seq += 1
+			self.queue = mutex.waiters
+			heapq.heappush(mutex.waiters, (self.task.priority, mutex.seq, self))
+		self.woken = False
+		return False
+
+	def close(self):
+		if self.queue != None:
+			waiters = self.mutex.waiters
+			for i in range(len(waiters)):
+				if waiters[i][2] is self:
+					waiters[i] = waiters[-1]
+					waiters.pop()
+					heapq.heapify(waiters)
+					break
+			self.queue = None
+		elif self.woken and not self.done:
+			self.woken = False
+			if self.mutex.locked == False:
+				self.mutex.unlock()
 
 
 # Mutex with request order priority
 # (first-come-first-served priority for waiting tasks)
 class BinarySemaphore(object):
 	def __init__(self):
-		self.wait_queue = []
+		self.wait_queue = collections.deque()  # BinarySemaphoreLock waiters
 		self.owner = None
 		
-	# This returns a task block condition generator
+	# This returns a task block condition
 	def lock(self, task):
-		self.wait_queue.append(task)
-
-		try:
-			while True:
-				if self.owner == None and self.wait_queue[0] == task:
-					self.owner = self.wait_queue.pop(0)
-					yield True
-				elif self.owner == self:
-					yield True
-				else:
-					yield False
-		finally:
-			# If this is combined with other block conditions,
-			# for example timeout, and one of those conditions
-			# unblocks before this, we need to prevent this
-			# from taking the lock and never releasing it.
-			if task in self.wait_queue:
-				self.wait_queue.remove(task)
+		return BinarySemaphoreLock(self, task)
 
 	def nb_lock(self, task):
 		if self.owner == None or self.owner == task:
@@ -179,8 +592,52 @@ class BinarySemaphore(object):
 		else:
 			return False
 
+	# Wakes only the task at the head of the queue
 	def unlock(self):
 		self.owner = None
+		if self.wait_queue:
+			self.wait_queue[0]._wake_head()
+
+
+class BinarySemaphoreLock(EventCondition):
+	def __init__(self, semaphore, task):
+		EventCondition.__init__(self, task)
+		self.semaphore = semaphore
+		# Joins the queue as soon as it is requested, which is what
+		# gives the semaphore its request order
+		self._wait(semaphore.wait_queue)
+
+	def __next__(self):
+		semaphore = self.semaphore
+		if semaphore.owner == None and semaphore.wait_queue and \
+		   semaphore.wait_queue[0] is self:
+			semaphore.wait_queue.popleft()
+			self.queue = None
+			semaphore.owner = self.task
+			self.done = True
+			return True
+		elif semaphore.owner == self.task:
+			self.done = True
+			self.close()
+			return True
 
-
-
+		self.woken = False
+		return False
+
+	# The head stays in the queue until it takes the lock, so waking it
+	# doesn't unregister it
+	def _wake_head(self):
+		self.woken = True
+		self.task.wake()
+
+	# If this is combined with other block conditions, for example
+	# timeout, and one of those conditions unblocks before this, we
+	# need to leave the queue so the next task can take the lock.
+	def close(self):
+		if self.queue != None:
+			semaphore = self.semaphore
+			was_head = semaphore.wait_queue[0] is self
+			semaphore.wait_queue.remove(self)
+			self.queue = None
+			if was_head and semaphore.owner == None and semaphore.wait_queue:
+				semaphore.wait_queue[0]._wake_head()
@@ -1,3 +1,6 @@
+import collections
+import heapq
+
 import pyRTOS
 
 
@@ -12,7 +15,7 @@ def default_scheduler(tasks):
 			elif task.state == pyRTOS.BLOCKED:
 				if True in map(lambda x: next(x), task.ready_conditions):
 					task.state = pyRTOS.READY
-					task.ready_conditions = []
+					task._clear_conditions()
 					if running_task == None:
 						running_task = task
 			elif task.state == pyRTOS.RUNNING:
@@ -29,7 +32,289 @@ def default_scheduler(tasks):
 			try:
 				messages = running_task.run_next()
 			except StopIteration:
+				# Deliver whatever it sent on its way out
+				messages = running_task._out_messages
 				tasks.remove(running_task)
+				pyRTOS.remove_task(running_task)
 
 		return messages
 
+
+# Scheduler with per-priority ready queues.
+#
+# default_scheduler walks every task on every pass.  This one only touches
+# a task when its state changes, so the cost of a pass does not grow with
+# the number of tasks:
+#
+#   - READY tasks sit in a FIFO per priority, and a bitmap of occupied
+#     priorities finds the highest one with a single bit trick.  This
+#     requires priorities to be non-negative integers.
+#   - BLOCKED tasks whose conditions all expose a deadline (timeout(),
+#     timeout_ns()) are parked on a timer heap and only looked at when
+#     the earliest deadline passes.
+#   - BLOCKED tasks waiting on event conditions (Mutex, BinarySemaphore,
+#     MessageQueue, messages, notifications) are parked too, and are only
+#     re-checked when the primitive calls task.wake().
+#   - BLOCKED tasks with any other condition (UFunctions, delay()) cannot
+#     be predicted and are polled every pass, as default_scheduler does.
+#
+# Use it with pyRTOS.start(scheduler=pyRTOS.PriorityScheduler()).  Like
+# default_scheduler, the running task keeps running until it blocks or a
+# strictly higher priority task becomes ready.
+class PriorityScheduler(object):
+	def __init__(self):
+		self.ready = {}           # priority -> deque of READY tasks
+		self.occupied = 0         # Bit n set when ready[n] is non-empty
+		self.queued = set()       # Tasks currently in a ready queue
+		self.polled = set()       # BLOCKED tasks that must be polled
+		self.timers = []          # Heap of (deadline, seq, task)
+		self.parked = {}          # BLOCKED task -> seq of its live timer
+		self.changed = collections.deque()  # Tasks to re-examine next pass,
+		                                    # appended to by other threads
+		self.running = None
+		self.seq = 0
+		self.tasks = None
+		self.task_count = 0
+		self.add_count = 0
+
+	def __call__(self, tasks):
+		# A task may add another in the same step that it finishes, which
+		# leaves the length of the list unchanged, so additions are
+		# counted rather than inferred from it.
+		if tasks is not self.tasks or len(tasks) != self.task_count or \
+		   pyRTOS.Task._add_count != self.add_count:
+			self._adopt(tasks)
+
+		changed = self.changed
+		while changed:
+			self._update(changed.popleft())
+
+		timers = self.timers
+		if timers:
+			now = pyRTOS.get_clock().monotonic()
+			while timers and timers[0][0] <= now:
+				deadline, seq, task = heapq.heappop(timers)
+				if self.parked.get(task) == seq and \
+				   not self._conditions_met(task):
+					# Shouldn't happen, but never strand a task
+					del self.parked[task]
+					self.polled.add(task)
+				elif self.parked.get(task) == seq:
+					self._unblock(task)
+
+		if self.polled:
+			for task in [t for t in self.polled if self._conditions_met(t)]:
+				self._unblock(task)
+
+		running = self.running
+		if self.queued:
+			if running == None or self._preempts(running):
+				if running != None:
+					running.state = pyRTOS.READY
+					self._push(running, front=True)
+				running = self._pop()
+				running.state = pyRTOS.RUNNING
+				self.running = running
+
+		if running == None:
+			return []
+
+		try:
+			messages = running.run_next()
+		except StopIteration:
+			self.running = None
+			running._listener = None
+			tasks.remove(running)
+			pyRTOS.remove_task(running)
+			self.task_count = len(tasks)
+			return running._out_messages
+
+		if running.state != pyRTOS.RUNNING:
+			self.running = None
+			if running.state == pyRTOS.BLOCKED:
+				self._block(running)
+			elif running.state == pyRTOS.READY:
+				self._push(running)
+
+		return messages
+
+	# Pick up tasks added since the last pass.  A full rebuild is only
+	# needed if tasks were removed behind the scheduler's back.
+	def _adopt(self, tasks):
+		if tasks is not self.tasks or len(tasks) < self.task_count:
+			self.__init__()
+			self.tasks = tasks
+
+		for task in tasks:
+			if task._listener != self.changed.append:
+				self._accept(task)
+				task._listener = self.changed.append
+				self._update(task)
+
+		self.task_count = len(tasks)
+		self.add_count = pyRTOS.Task._add_count
+
+	def _accept(self, task):
+		if task.priority < 0:
+			raise ValueError("PriorityScheduler requires non-negative priorities")
+
+	# Re-file a task after a state change made outside the scheduler.  A
+	# BLOCKED task that is already being tracked is just re-checked.
+	def _update(self, task):
+		if task.state == pyRTOS.BLOCKED and \
+		   (task in self.parked or task in self.polled):
+			self._check(task)
+			return
+
+		self._discard(task)
+		if task is self.running and task.state != pyRTOS.RUNNING:
+			self.running = None
+
+		if task.state == pyRTOS.BLOCKED:
+			self._block(task)
+		elif task.state == pyRTOS.READY:
+			self._push(task)
+		elif task.state == pyRTOS.RUNNING and task is not self.running:
+			task.state = pyRTOS.READY
+			self._push(task)
+
+	def _block(self, task):
+		deadline = None
+		for condition in task.ready_conditions:
+			if getattr(condition, "evented", False):
+				continue
+			condition_deadline = getattr(condition, "deadline", None)
+			if condition_deadline == None:
+				self.polled.add(task)
+				return
+			if deadline == None or condition_deadline < deadline:
+				deadline = condition_deadline
+
+		self.seq += 1
+		self.parked[task] = self.seq
+		if deadline != None:
+			heapq.heappush(self.timers, (deadline, self.seq, task))
+
+		# Conditions are first evaluated on the pass after the task
+		# blocks, matching default_scheduler.
+		self.changed.append(task)
+
+	def _check(self, task):
+		if self._conditions_met(task):
+			self._unblock(task)
+
+	def _conditions_met(self, task):
+		for condition in task.ready_conditions:
+			if next(condition):
+				return True
+		return False
+
+	def _unblock(self, task):
+		self.polled.discard(task)
+		self.parked.pop(task, None)
+		task.state = pyRTOS.READY
+		task._clear_conditions()
+		self._push(task)
+
+	def _discard(self, task):
+		self.polled.discard(task)
+		self.parked.pop(task, None)
+		if task in self.queued:
+			queue = self.ready[task.priority]
+			queue.remove(task)
+			self.queued.discard(task)
+			if not queue:
+				self.occupied &= ~(1 << task.priority)
+
+	def _push(self, task, front=False):
+		if task in self.queued:
+			return
+
+		queue = self.ready.get(task.priority)
+		if queue == None:
+			queue = self.ready[task.priority] = collections.deque()
+
+		if front:
+			queue.appendleft(task)
+		else:
+			queue.append(task)
+
+		self.queued.add(task)
+		self.occupied |= 1 << task.priority
+
+	def _top_priority(self):
+		return (self.occupied & -self.occupied).bit_length() - 1
+
+	# True if the best ready task should take over from the running one
+	def _preempts(self, running):
+		return self._top_priority() < running.priority
+
+	def _pop(self):
+		priority = self._top_priority()
+		queue = self.ready[priority]
+		task = queue.popleft()
+		self.queued.discard(task)
+		if not queue:
+			self.occupied &= ~(1 << priority)
+		return task
+
+
+# Earliest deadline first scheduler.
+#
+# The same as PriorityScheduler, except that the ready task with the
+# earliest absolute deadline runs first.  PeriodicTask jobs have the
+# deadline of their current period; other tasks have none and only run
+# when no periodic job is ready, ordered by priority.  A ready job with an
+# earlier deadline than the running task preempts it at its next yield.
+class EDFScheduler(PriorityScheduler):
+	def __init__(self):
+		PriorityScheduler.__init__(self)
+		self.ready = []    # Heap of (deadline, priority, seq, task)
+		self.queued = {}   # Task -> seq of its live heap entry
+
+	def _accept(self, task):
+		pass
+
+	@staticmethod
+	def _key(task):
+		deadline = getattr(task, "deadline", None)
+		return (deadline if deadline != None else float("inf"), task.priority)
+
+	def _peek(self):
+		ready = self.ready
+		while self.queued.get(ready[0][3]) != ready[0][2]:
+			heapq.heappop(ready)
+		return ready[0]
+
+	def _preempts(self, running):
+		entry = self._peek()
+		return (entry[0], entry[1]) < self._key(running)
+
+	def _pop(self):
+		task = self._peek()[3]
+		heapq.heappop(self.ready)
+		del self.queued[task]
+		return task
+
+	def _push(self, task, front=False):
+		if task in self.queued:
+			return
+
+		self.seq += 1
+		deadline, priority = self._key(task)
+		heapq.heappush(self.ready, (deadline, priority, self.seq, task))
+		self.queued[task] = self.seq
+
+	# Heap entries are dropped lazily by _peek()
+	def _discard(self, task):
+		self.polled.discard(task)
+		self.parked.pop(task, None)
+		self.queued.pop(task, None)
+
+
+# Assigns rate monotonic priorities to periodic tasks: the shorter the
+# period, the higher the priority, starting from highest.  Call it before
+# adding the tasks, for use with PriorityScheduler or default_scheduler.
+def rate_monotonic(periodic_tasks, highest=0):
+	for priority, task in enumerate(sorted(periodic_tasks, key=lambda t: t.period)):
+		task.priority = highest + priority
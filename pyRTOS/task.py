@@ -1,3 +1,9 @@
+import array
+import collections
+
+import pyRTOS
+
+
 
 # FreeRTOS states are
 #
@@ -31,7 +37,10 @@ SUSPENDED = 3   # Task is waiting for some other task to unsuspend
 
 
 class Task(object):
-	_out_messages = []
+	_run_count = 0   # Total run_next() calls, lets start() detect idle passes
+	_add_count = 0   # Total add_task() calls, lets schedulers spot new tasks
+	_monitor = None  # SchedulerMonitor installed by start(), if any
+	current = None   # The task inside run_next(), if any
 
 	def __init__(self, func, priority=255, name=None, notifications=None, mailbox=False):
 		self.func = func
@@ -41,13 +50,19 @@ class Task(object):
 		if notifications != None:
 			self.notes = (array.array('b', [0] * notifications),
 			              array.array('l', [0] * notifications))
+			self._note_waiters = []
 
+		self.mailbox = mailbox
 		if mailbox:
-			self._in_messages = []
+			self._in_messages = collections.deque()
+			self._message_waiter = None
+
+		self._out_messages = []
 
 		self.state = READY
 		self.ready_conditions = []
 		self.thread = None  # This is for the generator object
+		self._listener = None  # Set by schedulers that track state changes
 
 	# If the thread function is well behaved, this will get the generator
 	# for it, then it will start it, it will run its initialization code,
@@ -58,35 +73,47 @@ class Task(object):
 
 	# Run task until next yield
 	def run_next(self):
-		state_change = next(self.thread)
+		Task._run_count += 1
+		monitor = Task._monitor
+		if monitor != None:
+			started = monitor.task_started(self)
+
+		Task.current = self
+		try:
+			state_change = next(self.thread)
+		finally:
+			Task.current = None
+			if monitor != None:
+				monitor.task_stopped(self, started)
 
 		if state_change != None:
 			self.ready_conditions = state_change
 			self.state = BLOCKED
+			if monitor != None:
+				monitor.task_blocked(self, state_change)
 
-		msgs = Task._out_messages
-		Task._out_messages = []
+		# Only swap in a new outbox when something was sent
+		msgs = self._out_messages
+		if msgs:
+			self._out_messages = []
 
 		return msgs
 
 
 # Notification Functions #
 	def wait_for_notification(self, index=0, state=1):
-		self.notes[0][index] = 0
-		while self.notes[0][index] != state:
-			yield False
-
-		while True:
-			yield True
+		return pyRTOS.wait_for_notification(self, index, state)
 
 
 	def notify_set_value(self, index=0, state=1, value=0):
 		self.notes[0][index] = state
 		self.notes[1][index] = value
+		self._wake_note_waiters(index)
 
 	def notify_inc_value(self, index=0, state=1, step=1):
 		self.notes[0][index] = state
 		self.notes[1][index] += step
+		self._wake_note_waiters(index)
 
 	def notify_get_value(self, index=0):
 		return self.notes[1][index]
@@ -94,37 +121,154 @@ class Task(object):
 
 	def notify_set_state(self, index=0, state=1):
 		self.notes[0][index] = state
+		self._wake_note_waiters(index)
 
 	def notify_inc_state(self, index=0, step=1):
 		self.notes[0][index] += step
+		self._wake_note_waiters(index)
 
 	def notify_get_state(self, index=0):
 		return self.notes[0][index]
+
+	# Only waiters whose state has been reached are woken
+	def _wake_note_waiters(self, index):
+		if self._note_waiters:
+			state = self.notes[0][index]
+			for waiter in [w for w in self._note_waiters
+						   if w.index == index and w.state == state]:
+				self._note_waiters.remove(waiter)
+				waiter._wake()
 ##########################
 
 
 # Mailbox functions #
 	def send(self, msg):
-		Task._out_messages.append(msg)
+		self._out_messages.append(msg)
+
+	def send_many(self, msgs):
+		self._out_messages.extend(msgs)
 
+	# Hands over the inbox itself, a deque in arrival order, rather than
+	# copying it
 	def recv(self):
 		msgs = self._in_messages
-		self._in_messages = []
+		self._in_messages = collections.deque()
 		return msgs
 
+	# Like recv(), but takes at most max_n messages, oldest first, as a
+	# list.  The cost depends only on the size of the batch.
+	def recv_many(self, max_n):
+		msgs = self._in_messages
+		popleft = msgs.popleft
+		return [popleft() for i in range(min(max_n, len(msgs)))]
+
 	def message_count(self):
 		return len(self._in_messages)
 
 	def deliver(self, msg):
 		self._in_messages.append(msg)
+
+		waiter = self._message_waiter
+		if waiter != None:
+			self._message_waiter = None
+			waiter._wake()
 #####################
 
 
 	def suspend(self):
 		self.state = SUSPENDED
-		self.ready_conditions = []
+		self._clear_conditions()
+		self._state_changed()
 
 	def resume(self):
 		self.state = READY
+		self._clear_conditions()
+		self._state_changed()
+		pyRTOS.wakeup()
+
+	# Called by event block conditions when the event they are waiting
+	# on has happened.  Safe to call from other threads.
+	def wake(self):
+		if self.state == BLOCKED:
+			self._state_changed()
+			pyRTOS.wakeup()
+
+	# Drop the block conditions, letting any that registered as waiters
+	# withdraw.  Schedulers call this when the task unblocks.
+	def _clear_conditions(self):
+		for condition in self.ready_conditions:
+			close = getattr(condition, "close", None)
+			if close != None:
+				close()
 		self.ready_conditions = []
 
+	# Lets schedulers that keep their own ready and blocked queues follow
+	# state changes made outside of the scheduler.
+	def _state_changed(self):
+		if self._listener != None:
+			self._listener(self)
+
+
+# Periodic task
+#
+# Releases a job every period seconds, anchored to absolute time from when
+# the task is initialized, so the time a job takes doesn't push later
+# releases back the way "yield [timeout(period)]" does.  The task function
+# ends each job with "yield [self.next_period()]".
+#
+# As with any task, initialize() runs the function to its first yield and
+# discards what it yields, so the function should start with a bare
+# "yield" to have its first job run by the scheduler.  If its first yield
+# is a next_period() instead, the release it asked for is discarded and
+# the first scheduled job runs at the initial release.
+#
+# Each job must finish within deadline seconds of its release (the period,
+# by default).  Jobs that finish late are counted in overruns.  If a job
+# runs past one or more whole releases, those releases are skipped, and
+# counted in skipped, rather than run back to back to catch up.
+#
+# EDFScheduler orders ready tasks by the absolute deadline of their
+# current job, which is kept in self.deadline.
+class PeriodicTask(Task):
+	def __init__(self, func, period, deadline=None, priority=255, name=None, notifications=None, mailbox=False):
+		Task.__init__(self, func, priority, name, notifications, mailbox)
+		self.period = period
+		self.relative_deadline = deadline if deadline != None else period
+		self.release = None   # Release time of the current job
+		self.deadline = None  # Absolute deadline of the current job
+		self.jobs = 0
+		self.overruns = 0
+		self.skipped = 0
+
+	def initialize(self):
+		release = pyRTOS.get_clock().monotonic()
+		self._release_at(release)
+		Task.initialize(self)
+
+		# Undo any next_period() called before the first yield
+		self._release_at(release)
+		self.jobs = 0
+		self.overruns = 0
+		self.skipped = 0
+
+	def _release_at(self, release):
+		self.release = release
+		self.deadline = release + self.relative_deadline
+
+	# Block condition that ends the current job and waits for the next
+	# release
+	def next_period(self):
+		now = pyRTOS.get_clock().monotonic()
+		self.jobs += 1
+		if now > self.deadline:
+			self.overruns += 1
+
+		release = self.release + self.period
+		if now >= release + self.period:
+			missed = int((now - release) // self.period)
+			release += missed * self.period
+			self.skipped += missed
+
+		self.release = release
+		self.deadline = release + self.relative_deadline
+		return pyRTOS.timeout_until(release)
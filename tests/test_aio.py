@@ -0,0 +1,56 @@
+import asyncio
+import random
+import time
+import unittest
+
+import pyRTOS
+
+
+# Reads the time a little behind the real clock by a different amount on
+# every call, the way two clocks read at different moments disagree.
+class JitteryClock(pyRTOS.MonotonicClock):
+	def monotonic(self):
+		return time.monotonic() - random.uniform(0, 0.0005)
+
+
+class RunAsyncTimeoutTest(unittest.TestCase):
+	TASKS = 50
+	TIMEOUTS = 200
+
+	def setUp(self):
+		pyRTOS.reset()
+
+	def tearDown(self):
+		pyRTOS.reset()
+		pyRTOS.set_clock(pyRTOS.MonotonicClock())
+
+	def run_timeouts(self):
+		finished = []
+
+		def sleeper(self):
+			yield
+			for i in range(RunAsyncTimeoutTest.TIMEOUTS):
+				yield [pyRTOS.timeout(0.001)]
+			finished.append(self)
+
+		for priority in range(self.TASKS):
+			pyRTOS.add_task(pyRTOS.Task(sleeper, priority=priority))
+
+		try:
+			asyncio.run(asyncio.wait_for(pyRTOS.run_async(), 20))
+		except asyncio.TimeoutError:
+			pass
+
+		self.assertEqual(len(finished), self.TASKS)
+		self.assertEqual(len(pyRTOS.tasks), 0)
+
+	def test_many_short_timeouts(self):
+		self.run_timeouts()
+
+	def test_timers_firing_before_the_deadline(self):
+		pyRTOS.set_clock(JitteryClock())
+		self.run_timeouts()
+
+
+if __name__ == "__main__":
+	unittest.main()